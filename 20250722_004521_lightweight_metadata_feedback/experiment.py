@@ -1,196 +1,74 @@
 import argparse
+import asyncio
 import logging
 import re
 import os
-import json
-import numpy as np
+import sys
+from dataclasses import dataclass
+from functools import cached_property, lru_cache
 
 from langchain.schema import HumanMessage, SystemMessage
 from langchain_core.messages import BaseMessage
-from langchain_gigachat import GigaChat
 import src.text2sql_bench.settings  # noqa
-from src.text2sql_bench.core.benchmark import BenchRunner
-from src.text2sql_bench.core.model import BenchConfig, RunConfig
-from src.text2sql_bench.dataset import load_datasets
-from src.text2sql_bench.db import DbConnection
 from src.text2sql_bench.core.model import ContextData
 from src.text2sql_bench.db import DbConnection
-from src.text2sql_bench.model_wrappers.wrapper import ModelWrapper
-from src.text2sql_bench.vector_db import GoldRecord, TableInfo
+
+# the code the experiments share lives in text2sql_runtime, next to the experiment dirs
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from text2sql_runtime import prompts
+from text2sql_runtime.runner import add_run_arguments, run_benchmark, wrapper_kwargs
+from text2sql_runtime.sql import StaticValidationError
+from text2sql_runtime.tracing import report
+from text2sql_runtime.wrapper import ScientistWrapper
 
 
-class DeepseekAIScientist(ModelWrapper):
+class DeepseekAIScientist(ScientistWrapper):
+    # the intent check needs the column metadata an EXPLAIN does not return
+    validation_modes = ("limit0", "execute")
+
     def __init__(
         self,
-        model: str,
-        base_url: str,
-        verify_ssl_certs: bool,
-        temperature: float,
-        timeout: int,
-        prompt_data: dict[str, str],
-        profanity_check: bool = False,
-        user: str | None = None,
-        password: str | None = None,
-        cert_file: str | None = None,
-        key_file: str | None = None,
-        credentials: str | None = None,
-        model_name: str | None = "deepseek-coder-v2",
-        retries_num: int = 3,
-        schema_type: str | None = None,
-        **model_kwargs,
+        *args,
+        preview_rows: int = 0,
+        error_classifier: "SqlErrorClassifier | None" = None,
+        **kwargs,
     ):
-        giga = GigaChat(
-            model=model,
-            base_url=base_url,
-            cert_file=cert_file,
-            key_file=key_file,
-            user=user,
-            password=password,
-            credentials=credentials,
-            access_token=credentials,
-            verify_ssl_certs=verify_ssl_certs,
-            profanity_check=profanity_check,
-            temperature=temperature,
-            timeout=timeout,
-            **model_kwargs,
-        )
-        self._init_prompt(prompt_data)
-        self.model = giga
-        self.model_name = model_name
-
-        self.retries_num = retries_num
-        self.schema_type = schema_type
-
-    def _get_result_metadata(self, db: DbConnection, sql: str) -> list[str]:
-        """Get column names from query result metadata"""
-        try:
-            cursor = db.execute(sql)
-            return [col[0] for col in cursor.description] if cursor.description else []
-        except Exception:
-            return []
+        super().__init__(*args, **kwargs)
+        self.preview_rows = preview_rows
+        self.error_classifier = error_classifier or SQL_ERROR_CLASSIFIER
 
     def _has_column_mismatch(self, question: str, columns: list[str]) -> bool:
         """Check if returned columns match question intent using NLP patterns and semantic similarity"""
-        if not columns:
-            return False
-            
-        # Enhanced domain-specific synonym mapping
-        SYNONYMS = {
-            'job': ['position', 'role', 'employment', 'vacancy', 'opening', 'post'],
-            'salary': ['pay', 'compensation', 'wage', 'remuneration', 'earnings'],
-            'company': ['organization', 'firm', 'employer', 'business', 'enterprise'],
-            'location': ['place', 'city', 'region', 'area', 'site', 'address'],
-            'date': ['time', 'day', 'when', 'period', 'schedule'],
-            'experience': ['background', 'qualification', 'skill', 'expertise'],
-            'requirement': ['condition', 'prerequisite', 'qualification', 'criteria'],
-            'description': ['summary', 'profile', 'overview', 'details']
-        }
-            
-        # Extract key terms from question
-        question_lower = question.lower()
-        expected_terms = set()
-        
-        # Look for "show me X" patterns
-        if "show me" in question_lower:
-            expected_terms.update(re.findall(r'show me ([\w\s]+?)(?:$|,|\.|;)', question_lower))
-            
-        # Look for "what is X" patterns  
-        expected_terms.update(re.findall(r'what (?:is|are) (?:the )?([\w\s]+?)(?:$|,|\.|;)', question_lower))
-        
-        # Look for direct column mentions
-        expected_terms.update(re.findall(r'(?:column|field)s? ([\w\s]+?)(?:$|,|\.|;)', question_lower))
-        
-        # Check if any expected term appears in result columns
-        columns_lower = [col.lower() for col in columns]
-        for term in expected_terms:
-            term = term.strip()
-            if not term:
-                continue
-                
-            # Handle plurals
-            singular_term = term.rstrip('s') if term.endswith('s') else term
-            plural_term = f"{singular_term}s" if not term.endswith('s') else term
-                
-            # Basic string matching
-            if (any(term in col or col in term for col in columns_lower) or
-                any(singular_term in col or col in singular_term for col in columns_lower) or
-                any(plural_term in col or col in plural_term for col in columns_lower)):
-                continue
-                
-            # Check synonyms
-            synonym_matched = False
-            for word, syns in SYNONYMS.items():
-                if word in term:
-                    for syn in syns:
-                        if any(syn in col or col in syn for col in columns_lower):
-                            synonym_matched = True
-                            break
-            if synonym_matched:
-                continue
-                
-            # Split into words and check individual components
-            term_words = term.split()
-            col_words = [w for col in columns_lower for w in col.split('_')]
-            
-            # Check if any word from term appears in any column
-            if not any(any(word in col_word for col_word in col_words) for word in term_words):
-                return True
-                
-        return False
+        return COLUMN_MATCHER.has_mismatch(question, columns)
 
     def _should_regenerate(self, error: str, sql: str) -> bool:
         """Determine if regeneration should be attempted based on error type and confidence"""
-        error_lower = error.lower()
-        sql_lower = sql.lower()
-        
-        # High confidence errors (definite regeneration)
-        high_confidence = [
-            (r"no such column:?\s*['\"]?(\w+)", "column"),
-            (r"no such table:?\s*['\"]?(\w+)", "table"),
-            (r"near ['\"]?(\w+)['\"]?:?\s*syntax error", "syntax"),
-            (r"unexpected token ['\"]?(\w+)", "syntax"),
-            (r"mismatched input ['\"]?(\w+)", "syntax")
-        ]
-        
-        for pattern, _ in high_confidence:
-            if re.search(pattern, error_lower):
-                return True
-                
-        # Medium confidence errors (regenerate if basic structure exists)
-        medium_confidence = [
-            (r"missing (\w+)", "structure"),
-            (r"invalid (\w+) reference", "reference"),
-            (r"column (\w+) does not exist", "column"),
-            (r"table (\w+) does not exist", "table")
-        ]
-        
-        has_basic_structure = ("select" in sql_lower and "from" in sql_lower)
-        for pattern, _ in medium_confidence:
-            if re.search(pattern, error_lower) and has_basic_structure:
-                return True
-                
-        # Low confidence/ambiguous errors (don't regenerate)
-        ambiguous_errors = [
-            "ambiguous column",
-            "could not determine data type",
-            "operator does not exist",
-            "function does not exist"
-        ]
-        
-        if any(e in error_lower for e in ambiguous_errors):
-            return False
-            
-        return False
+        return self.error_classifier.should_regenerate(error, sql)
 
-    def predict_sql(self, context: ContextData, db: DbConnection | None = None) -> str:
+    async def apredict_sql(
+        self, context: ContextData, db: DbConnection | None = None
+    ) -> str:
+        fragments = PromptFragments(self, context)
         if self.hint_filter_user_prompt and self.hint_filter_user_prompt:
-            context.hints = self._filter_hints(context)
-        messages = [
-            SystemMessage(content=self._build_system_prompt(context)),
-            HumanMessage(content=self._build_user_prompt(context)),
-        ]
+            context.hints = await self._filter_hints(context, fragments)
+        messages = self._build_messages(context, fragments)
 
-        result = self.model.invoke(messages)
+        if self.speculative_candidates > 1:
+
+            async def is_valid(candidate: BaseMessage) -> bool:
+                execution = await self._aexecute_candidate(
+                    db, self._parse_sql(candidate), context
+                )
+                return execution.ok and not self._has_column_mismatch(
+                    context.question, execution.columns
+                )
+
+            result, valid = await self._agenerate_first_valid(messages, is_valid)
+            if valid:
+                return self._parse_sql(result)
+        else:
+            result = await self._ainvoke(messages)
         sql = self._parse_sql(result)
 
         logging.debug(
@@ -200,197 +78,78 @@ class DeepseekAIScientist(ModelWrapper):
         # First try execution and column check
         cur_try = 0
         while cur_try < self.retries_num:
-            try:
-                db.execute(sql)
-                columns = self._get_result_metadata(db, sql)
-                if self._has_column_mismatch(context.question, columns):
-                    raise ValueError("Possible column mismatch in results")
-                return sql
-            except Exception as e:
-                error_str = str(e)
-                if not self._should_regenerate(error_str, sql):
+            # one execution per candidate feeds the column check and the regen prompts
+            execution = await self._aexecute_candidate(db, sql, context)
+            if execution.ok:
+                if not self._has_column_mismatch(context.question, execution.columns):
                     return sql
-                    
-                print(
-                    f'Generated SQL executed with error: {error_str}. Regenerating sql for question: "{context.question}"'
-                )
-                messages = [
-                    SystemMessage(
-                        content=self._build_regen_system_prompt(context, sql, error_str)
-                    ),
-                    HumanMessage(
-                        content=self._build_regen_user_prompt(context, sql, error_str)
-                    ),
-                ]
-                result = self.model.invoke(messages)
-                sql = self._parse_sql(result)
-                cur_try += 1
-
-                logging.debug(
-                    f"Результат после перегенерации {cur_try}: {result} for question: {context.question}"
-                )
-
-        return sql
+                error_str = "Possible column mismatch in results"
+            else:
+                error_str = execution.error
+            if not self._should_regenerate(error_str, sql):
+                return sql
 
-    @staticmethod
-    def _to_chunks(arr: list[any], size: int) -> list[list[any]]:
-        return [arr[i : i + size] for i in range(0, len(arr), size)]
-
-    def _filter_hints(self, context: ContextData) -> list[str]:
-        if not self.hint_filter_system_prompt:
-            raise ValueError("Missing 'hint_filter_system_prompt' key in the prompt")
-        if not self.hint_filter_user_prompt:
-            raise ValueError("Missing 'hint_filter_user_prompt' key in the prompt")
-        if context.hints:
-            hints_str = "\n".join(context.hints)
-        else:
-            hints_str = ""
-        logging.debug(f"Question: {context.question}")
-        logging.debug(f"Original hints: \n{hints_str}")
-        chunk_size = 5
-        result = []
-        if context.hints:
-            hint_chunks = self._to_chunks(context.hints, chunk_size)
-        else:
-            hint_chunks = []
-        for chunk in hint_chunks:
+            report(
+                f'Generated SQL executed with error: {error_str}. Regenerating sql for question: "{context.question}"'
+            )
             messages = [
                 SystemMessage(
-                    content=self.hint_filter_system_prompt.format(
-                        hints="\n".join(chunk),
-                        ddl=self._ddl_to_str(context.ddl) if context.ddl else "",
-                        gold=self._gold_to_str(context.gold_recs)
-                        if context.gold_recs
-                        else "",
-                        stats=self._tables_info_to_str(context.tables_info)
-                        if context.tables_info
-                        else "",
-                        question=context.question,
+                    content=self._build_regen_system_prompt(
+                        context, sql, error_str, fragments
                     )
                 ),
                 HumanMessage(
-                    content=self.hint_filter_user_prompt.format(
-                        hints="\n".join(chunk),
-                        ddl=self._ddl_to_str(context.ddl) if context.ddl else "",
-                        gold=self._gold_to_str(context.gold_recs)
-                        if context.gold_recs
-                        else "",
-                        stats=self._tables_info_to_str(context.tables_info)
-                        if context.tables_info
-                        else "",
-                        question=context.question,
+                    content=self._build_regen_user_prompt(
+                        context, sql, error_str, fragments, execution
                     )
                 ),
             ]
-            response = self.model.invoke(messages).content
-            filtered_hints = [] if "NONE" == response else response.split("\n")
-            result.extend(filtered_hints)
-            hints_str = "\n".join(result)
-        logging.debug(f"Reduced hints: \n {hints_str}")
-        return result
-
-    def enhance_question(self, question: str):
-        if self.enhance_system_prompt:
-            messages = [
-                SystemMessage(content=self.enhance_system_prompt),
-                HumanMessage(content=question),
-            ]
-            return self.model.invoke(messages).content
-        else:
-            raise ValueError("Missing 'enhance_system_prompt' key in the prompt")
+            result = await self._ainvoke(messages)
+            sql = self._parse_sql(result)
+            cur_try += 1
 
-    def name(self) -> str:
-        return self.model_name if self.model_name is not None else self.model.model
+            logging.debug(
+                f"Результат после перегенерации {cur_try}: {result} for question: {context.question}"
+            )
 
-    @staticmethod
-    def _parse_sql(response: BaseMessage) -> str:
-        sql = response.content
-        if "```sql" in sql:
-            sql = sql.split("```sql")[1].strip().split("```")[0]
-        sql = (
-            sql.replace("\r\n", " ")
-            .replace("\\n", " ")
-            .replace("\n", " ")
-            .strip()
-            .replace(" +", " ")
-            .strip()
-        )
-        if "<think>" in sql:
-            sql = re.sub(r"<think>.*?</think>\n?", "", sql, flags=re.DOTALL)
         return sql
 
-    def _init_prompt(self, prompt_data: dict[str, str]):
-        if "system_prompt" not in prompt_data:
-            raise ValueError("Missing 'system_prompt' key in the prompt")
-        if "user_prompt" not in prompt_data:
-            raise ValueError("Missing 'user_prompt' key in the prompt")
-        if "regen_system_prompt" not in prompt_data:
-            raise ValueError("Missing 'regen_system_prompt' key in the prompt")
-        if "regen_user_prompt" not in prompt_data:
-            raise ValueError("Missing 'regen_user_prompt' key in the prompt")
-
-        self.system_prompt = prompt_data["system_prompt"]
-        self.user_prompt = prompt_data["user_prompt"]
-        self.regen_system_prompt = prompt_data["regen_system_prompt"]
-        self.regen_user_prompt = prompt_data["regen_user_prompt"]
-
-        self.hint_filter_system_prompt = prompt_data.get(
-            "hint_filter_system_prompt", ""
-        )
-        self.hint_filter_user_prompt = prompt_data.get("hint_filter_user_prompt", "")
-        self.enhance_system_prompt = prompt_data.get("enhance_system_prompt", "")
+    async def _aexecute_candidate(
+        self, db: DbConnection, sql: str, context: ContextData | None = None
+    ) -> "ExecutionResult":
+        """Run a candidate once and capture everything later steps need to know about it.
 
-    @staticmethod
-    def _gold_to_str(gold: list[GoldRecord]) -> str:
-        text_gold_recs: list[str] = []
-        for g in gold:
-            text_gold_recs.append(f"Вопрос:{g.question}: ```sql\n{g.sql}\n```")
-        gold_str = "\n".join(text_gold_recs)
-        return f"""\nПримеры sql запросов: {gold_str}"""
+        Issues found by `static_validator` are returned as the error without running
+        the query.
+        """
+        if context is not None:
+            try:
+                self._static_check(context, sql)
+            except StaticValidationError as e:
+                return ExecutionResult(sql=sql, error=str(e))
+        mode = self.validation_mode
+
+        def execute() -> ExecutionResult:
+            with self._db_lock:
+                cursor = db.execute(self._validation_sql(sql, mode))
+                description = cursor.description or []
+                rows = []
+                if self.preview_rows and description and mode == "execute":
+                    rows = cursor.fetchmany(self.preview_rows)
+            return ExecutionResult(
+                sql=sql,
+                columns=tuple(col[0] for col in description),
+                types=tuple(str(col[1]) for col in description),
+                rows=tuple(tuple(row) for row in rows),
+            )
 
-    @staticmethod
-    def _hints_to_str(hints: list[str]) -> str:
-        hints_str = "\n".join(hints)
-        return f"""Вот полезная информация которую нужно использовать в SELECT: \n{hints_str}"""
+        try:
+            return await asyncio.to_thread(execute)
+        except Exception as e:
+            return ExecutionResult(sql=sql, error=str(e))
 
     @staticmethod
-    def _ddl_to_str(ddl: str) -> str:
-        if ddl:
-            return f"""Схема базы: {ddl}"""
-        else:
-            return ""
-
-    def _tables_info_to_str(self, tables_info: list[TableInfo]) -> str:
-        if not self.schema_type:
-            text_cols_info: list[str] = []
-            for table_info in tables_info:
-                table_name = table_info.name
-                for col_info in table_info.cols_info:
-                    text_cols_info.append(
-                        f"Таблица: {table_name}, {col_info.pretty_print()}"
-                    )
-            cols_str = "\n".join(text_cols_info)
-            return f"""\nДополнительная информация: {cols_str}"""
-        elif self.schema_type == "M-schema":
-            text_cols_info: list[str] = ["【Schema】"]
-            for table_info in tables_info:
-                table_name = table_info.name
-                text_cols_info.extend([f"# Table: {table_name}", "["])
-                for i, col_info in enumerate(table_info.cols_info):
-                    col_str = (
-                        f"({col_info.name}:{col_info.data_type},{col_info.description},"
-                        f"Examples: {col_info.categories if col_info.categories else col_info.samples})"
-                    )
-                    if i < len(table_info.cols_info) - 1:
-                        col_str += ","
-                    text_cols_info.append(col_str)
-                text_cols_info.append("]")
-            final_str = "\n".join(text_cols_info)
-            return final_str
-        else:
-            raise NotImplementedError
-
-    def _build_system_prompt(self, context: ContextData) -> str:
+    def _column_guidance(context: ContextData) -> str:
         # Enhanced column selection guidance
         column_guidance = ""
         if context.tables_info:
@@ -462,56 +221,33 @@ class DeepseekAIScientist(ModelWrapper):
                 column_guidance += "  * SELECT ... ORDER BY column ASC LIMIT 5 (get top 5)\n"
                 column_guidance += "  * SELECT ... ORDER BY col1, col2 DESC (multi-column sort)"
 
-        system_prompt = self.system_prompt.format(
-            hints=self._hints_to_str(context.hints) if context.hints else "",
-            ddl=self._ddl_to_str(context.ddl) if context.ddl else "",
-            gold=self._gold_to_str(context.gold_recs) if context.gold_recs else "",
-            stats=self._tables_info_to_str(context.tables_info)
-            if context.tables_info
-            else "",
-        ) + column_guidance
-
-        return system_prompt
+        return column_guidance
 
-    def _build_user_prompt(self, context: ContextData) -> str:
-        user_prompt = self.user_prompt.format(
-            hints=self._hints_to_str(context.hints) if context.hints else "",
-            ddl=self._ddl_to_str(context.ddl) if context.ddl else "",
-            gold=self._gold_to_str(context.gold_recs) if context.gold_recs else "",
-            stats=self._tables_info_to_str(context.tables_info)
-            if context.tables_info
-            else "",
-            question=context.question,
-        )
-
-        return user_prompt
-
-    def _build_regen_system_prompt(
-        self, context: ContextData, failed_sql: str, sql_error: str
+    def _build_system_prompt(
+        self, context: ContextData, fragments: "PromptFragments | None" = None
     ) -> str:
-        system_prompt = self.regen_system_prompt.format(
-            sql=failed_sql,
-            result=sql_error,
-            gold=self._gold_to_str(context.gold_recs) if context.gold_recs else "",
-            hints=self._hints_to_str(context.hints) if context.hints else "",
-            ddl=self._ddl_to_str(context.ddl) if context.ddl else "",
-            stats=self._tables_info_to_str(context.tables_info)
-            if context.tables_info
-            else "",
-        )
+        fragments = fragments or PromptFragments(self, context)
+        system_prompt = self.system_prompt.format(
+            hints=fragments.hints,
+            ddl=fragments.ddl,
+            gold=fragments.gold,
+            stats=fragments.stats,
+        ) + fragments.guidance
 
         return system_prompt
 
     def _build_regen_user_prompt(
-        self, context: ContextData, failed_sql: str, sql_error: str
+        self,
+        context: ContextData,
+        failed_sql: str,
+        sql_error: str,
+        fragments: "PromptFragments | None" = None,
+        execution: "ExecutionResult | None" = None,
     ) -> str:
-        # Get column metadata if available
-        columns = []
-        try:
-            columns = self._get_result_metadata(context.db, failed_sql)
-        except Exception:
-            pass
-            
+        fragments = fragments or PromptFragments(self, context)
+        # Column metadata of the caller's execution; the query is not run again here
+        columns = list(execution.columns) if execution is not None else []
+
         # Analyze error type for more specific feedback
         error_feedback = ""
         error_lower = sql_error.lower()
@@ -610,17 +346,337 @@ class DeepseekAIScientist(ModelWrapper):
             question=context.question,
             sql=failed_sql,
             result=sql_error + column_feedback,
-            gold=self._gold_to_str(context.gold_recs) if context.gold_recs else "",
-            hints=self._hints_to_str(context.hints) if context.hints else "",
-            ddl=self._ddl_to_str(context.ddl) if context.ddl else "",
-            stats=self._tables_info_to_str(context.tables_info)
-            if context.tables_info
-            else "",
+            gold=fragments.gold,
+            hints=fragments.hints,
+            ddl=fragments.ddl,
+            stats=fragments.stats,
         )
 
         return system_prompt
 
 
+class PromptFragments(prompts.PromptFragments):
+    """Prompt pieces plus the column guidance of the metadata feedback"""
+
+    SECTIONS = prompts.PromptFragments.SECTIONS + ("guidance",)
+
+    @cached_property
+    def guidance(self) -> str:
+        return self._wrapper._column_guidance(self._context)
+
+
+@dataclass(frozen=True)
+class ExecutionResult:
+    """What running a candidate SQL told us: the error, or its columns and a preview"""
+
+    sql: str
+    error: str | None = None
+    columns: tuple[str, ...] = ()
+    types: tuple[str, ...] = ()
+    rows: tuple[tuple, ...] = ()
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass(frozen=True)
+class _ResultColumns:
+    """Lowercase columns of one result, joined for substring search"""
+
+    names: frozenset[str]
+    lengths: frozenset[int]
+    # NUL separated, as question terms consist of word and space characters only
+    joined: str
+    words: str
+    concepts: tuple[str, ...]
+
+
+class ColumnMatcher:
+    """Checks that the columns of a result cover the terms a question asks for.
+
+    A term extracted from the question matches when it, its singular or its plural
+    is a substring of a column or the other way around, when it mentions a concept
+    some synonym of which matches a column that way, or when one of its words is
+    part of a column word. Everything independent of the result is compiled once:
+    the question patterns, a pattern per concept over its synonyms and the set of
+    the synonyms' substrings, which turns "column in synonym" into a lookup. Question
+    terms and result columns are memoized, since every candidate and retry of a
+    question checks the same question and often the same columns.
+    """
+
+    SYNONYMS = {
+        "job": ["position", "role", "employment", "vacancy", "opening", "post"],
+        "salary": ["pay", "compensation", "wage", "remuneration", "earnings"],
+        "company": ["organization", "firm", "employer", "business", "enterprise"],
+        "location": ["place", "city", "region", "area", "site", "address"],
+        "date": ["time", "day", "when", "period", "schedule"],
+        "experience": ["background", "qualification", "skill", "expertise"],
+        "requirement": ["condition", "prerequisite", "qualification", "criteria"],
+        "description": ["summary", "profile", "overview", "details"],
+    }
+    _SHOW_ME = re.compile(r"show me ([\w\s]+?)(?:$|,|\.|;)")
+    _WHAT_IS = re.compile(r"what (?:is|are) (?:the )?([\w\s]+?)(?:$|,|\.|;)")
+    _COLUMN_MENTION = re.compile(r"(?:column|field)s? ([\w\s]+?)(?:$|,|\.|;)")
+
+    def __init__(self, cache_size: int = 1024):
+        # concept -> (pattern of its synonyms, every substring of its synonyms)
+        self._concepts = {
+            concept: (
+                re.compile("|".join(map(re.escape, synonyms))),
+                {syn[i:j] for syn in synonyms for i in range(len(syn)) for j in range(i, len(syn) + 1)},
+            )
+            for concept, synonyms in self.SYNONYMS.items()
+        }
+        self.question_terms = lru_cache(maxsize=cache_size)(self._question_terms)
+        self.result_columns = lru_cache(maxsize=cache_size)(self._result_columns)
+
+    def _question_terms(self, question: str) -> tuple[str, ...]:
+        question_lower = question.lower()
+        terms = set()
+        if "show me" in question_lower:
+            terms.update(self._SHOW_ME.findall(question_lower))
+        terms.update(self._WHAT_IS.findall(question_lower))
+        terms.update(self._COLUMN_MENTION.findall(question_lower))
+        return tuple(term for term in (term.strip() for term in terms) if term)
+
+    def _result_columns(self, columns: tuple[str, ...]) -> _ResultColumns:
+        names = frozenset(col.lower() for col in columns)
+        joined = "\0".join(names)
+        return _ResultColumns(
+            names=names,
+            lengths=frozenset(map(len, names)),
+            joined=joined,
+            words=joined.replace("_", "\0"),
+            concepts=tuple(
+                concept
+                for concept, (pattern, substrings) in self._concepts.items()
+                if pattern.search(joined) or not names.isdisjoint(substrings)
+            ),
+        )
+
+    @staticmethod
+    def _covers(result: _ResultColumns, text: str) -> bool:
+        """Whether `text` is part of a column or a column is part of `text`"""
+        if text in result.joined:
+            return True
+        if len(result.lengths) * len(text) < len(result.names):
+            # look up the slices of `text` as long as some column instead of scanning
+            return any(
+                text[i : i + length] in result.names
+                for length in result.lengths
+                for i in range(len(text) - length + 1)
+            )
+        return any(col in text for col in result.names)
+
+    def has_mismatch(self, question: str, columns: list[str]) -> bool:
+        if not columns:
+            return False
+        terms = self.question_terms(question)
+        if not terms:
+            return False
+        result = self.result_columns(tuple(columns))
+        for term in terms:
+            singular = term.rstrip("s") if term.endswith("s") else term
+            plural = f"{singular}s" if not term.endswith("s") else term
+            if any(self._covers(result, text) for text in {term, singular, plural}):
+                continue
+            if any(concept in term for concept in result.concepts):
+                continue
+            if not any(word in result.words for word in term.split()):
+                return True
+        return False
+
+
+COLUMN_MATCHER = ColumnMatcher()
+
+
+@dataclass(frozen=True)
+class SqlError:
+    """What the error message of a query tells about what went wrong"""
+
+    kind: str
+    identifier: str | None = None
+    # (line, column) of the caret under the query echoed by DuckDB and Postgres
+    position: tuple[int, int] | None = None
+    dialect: str | None = None
+    # matched a `structural` pattern, only worth fixing in a query with a SELECT ... FROM
+    structural: bool = False
+
+
+@dataclass(frozen=True)
+class DialectPack:
+    """Error patterns of one database, `(kind, regex)` with an optional `id` group.
+
+    `marker` recognizes the messages of the database, so its pack is tried first.
+    `structural` patterns are searched after `patterns` and their errors are worth
+    another attempt only when the query has a SELECT ... FROM to fix.
+    Engines spell their messages one way, so patterns are case sensitive by default.
+    """
+
+    name: str
+    marker: str | None
+    patterns: tuple[tuple[str, str], ...]
+    ignore_case: bool = False
+    structural: tuple[tuple[str, str], ...] = ()
+
+
+DIALECT_PACKS = (
+    DialectPack(
+        "duckdb",
+        r"duckdb|(?:Parser|Binder|Catalog|Conversion) Error",
+        (
+            ("syntax", r'Parser Error: syntax error at or near "(?P<id>[^"]*)"'),
+            ("syntax", r"Parser Error"),
+            ("column", r'Referenced column "(?P<id>[^"]+)" not found'),
+            ("column", r'does not have a column named "(?P<id>[^"]+)"'),
+            ("table", r"Table with name (?P<id>[^\s!]+) does not exist"),
+            ("table", r'Referenced table "(?P<id>[^"]+)" not found'),
+            ("function", r"Function with name (?P<id>\w+) does not exist"),
+            ("function", r"No function matches the given name and argument types '(?P<id>[^(']+)"),
+            ("group_by", r'column "(?P<id>[^"]+)" must appear in the GROUP BY clause'),
+            ("ambiguous", r'Ambiguous reference to column name "(?P<id>[^"]+)"'),
+            ("type", r"Conversion Error"),
+            ("environment", r"IO Error|Out of Memory Error|INTERRUPT Error|Connection Error"),
+        ),
+    ),
+    DialectPack(
+        "postgres",
+        r"psycopg|postgres|asyncpg",
+        (
+            ("syntax", r'syntax error at or near "(?P<id>[^"]*)"'),
+            ("syntax", r"syntax error at end of input"),
+            ("column", r'column "?(?P<id>[\w.]+)"? does not exist'),
+            ("table", r'relation "(?P<id>[^"]+)" does not exist'),
+            ("table", r'missing FROM-clause entry for table "(?P<id>[^"]+)"'),
+            ("function", r"function (?P<id>[\w.]+)\(.*?\) does not exist"),
+            ("group_by", r'column "(?P<id>[^"]+)" must appear in the GROUP BY clause'),
+            ("ambiguous", r'column reference "(?P<id>[^"]+)" is ambiguous'),
+            ("type", r"operator does not exist|invalid input syntax for type"),
+            ("type", r"could not determine data type"),
+            ("environment", r"could not connect|server closed the connection|statement timeout"),
+        ),
+    ),
+    DialectPack(
+        "sqlite",
+        r"sqlite",
+        (
+            ("column", r"no such column:?\s*['\"]?(?P<id>[\w.]+)"),
+            ("table", r"no such table:?\s*['\"]?(?P<id>[\w.]+)"),
+            ("syntax", r"near \"(?P<id>[^\"]*)\": syntax error"),
+            ("syntax", r"incomplete input|unrecognized token"),
+            ("function", r"no such function: (?P<id>\w+)"),
+            ("ambiguous", r"ambiguous column name: (?P<id>[\w.]+)"),
+            ("group_by", r"misuse of aggregate"),
+            ("environment", r"database is locked|unable to open database"),
+        ),
+    ),
+    # the patterns the feedback loop matched before dialect packs, for any other engine
+    DialectPack(
+        "generic",
+        None,
+        (
+            ("column", r"no such column:?\s*['\"]?(?P<id>\w+)"),
+            ("table", r"no such table:?\s*['\"]?(?P<id>\w+)"),
+            ("syntax", r"near ['\"]?(?P<id>\w+)['\"]?:?\s*syntax error"),
+            ("syntax", r"unexpected token ['\"]?(?P<id>\w+)"),
+            ("syntax", r"mismatched input ['\"]?(?P<id>\w+)"),
+            ("ambiguous", r"ambiguous column"),
+            ("type", r"could not determine data type|operator does not exist"),
+            ("function", r"function does not exist"),
+        ),
+        ignore_case=True,
+        structural=(
+            ("structure", r"missing (?P<id>\w+)"),
+            ("reference", r"invalid (?P<id>\w+) reference"),
+            ("column", r"column (?P<id>\w+) does not exist"),
+            ("table", r"table (?P<id>\w+) does not exist"),
+        ),
+    ),
+)
+
+
+class SqlErrorClassifier:
+    """Turns database error messages into a SqlError, with one compiled regex per dialect.
+
+    The patterns of a DialectPack are joined into a single alternation and the markers
+    of all packs into another, so a message costs one search to find its dialect and
+    usually one more to classify it. A message without a marker is tried against the
+    packs without one first. Results are memoized per message.
+
+    `should_regenerate` keeps the policy of the feedback loop: the classes in
+    `regenerate_kinds` are worth another attempt, `structural` matches only when the
+    query has a SELECT ... FROM to fix, and ambiguous, type, function, environment and
+    unrecognized errors are not.
+    """
+
+    _CARET = re.compile(r"LINE (\d+): [^\n]*\n( *)\^")
+
+    def __init__(
+        self,
+        packs: tuple[DialectPack, ...] = DIALECT_PACKS,
+        regenerate_kinds: frozenset[str] = frozenset({"syntax", "column", "table", "group_by"}),
+        cache_size: int = 1024,
+    ):
+        self.regenerate_kinds = regenerate_kinds
+        self._packs: list[tuple[str, list[tuple[re.Pattern, list[str], bool]]]] = []
+        for pack in packs:
+            flags = re.IGNORECASE if pack.ignore_case else 0
+            tiers = [(pack.patterns, False), (pack.structural, True)]
+            self._packs.append((pack.name, [
+                (self._compile(patterns, flags), [kind for kind, _ in patterns], structural)
+                for patterns, structural in tiers
+                if patterns
+            ]))
+        # without a marker the message comes from an engine no dialect pack knows
+        self._unmarked = sorted(range(len(packs)), key=lambda i: packs[i].marker is not None)
+        markers = [f"(?P<p{i}>{pack.marker})" for i, pack in enumerate(packs) if pack.marker]
+        # an empty alternation would match every message
+        self._markers = re.compile("|".join(markers)) if markers else None
+        # the same few messages come back for many questions
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    @staticmethod
+    def _compile(patterns: tuple[tuple[str, str], ...], flags: int) -> re.Pattern:
+        alternatives = [
+            f"(?P<k{n}>{pattern.replace('(?P<id>', f'(?P<id{n}>')})"
+            for n, (_, pattern) in enumerate(patterns)
+        ]
+        return re.compile("|".join(alternatives), flags)
+
+    def _classify(self, error: str) -> SqlError:
+        caret = self._CARET.search(error)
+        position = None
+        if caret:
+            line = int(caret.group(1))
+            position = (line, len(caret.group(2)) - len(f"LINE {line}: ") + 1)
+        packs = self._packs
+        marker = self._markers.search(error) if self._markers else None
+        if marker:
+            first = int(marker.lastgroup[1:])
+            packs = [packs[first]] + packs[:first] + packs[first + 1 :]
+        else:
+            packs = [packs[i] for i in self._unmarked]
+        for name, tiers in packs:
+            for pattern, kinds, structural in tiers:
+                match = pattern.search(error)
+                if match:
+                    n = int(match.lastgroup[1:])
+                    identifier = match.groupdict().get(f"id{n}")
+                    return SqlError(kinds[n], identifier, position, name, structural)
+        return SqlError("unknown", position=position)
+
+    def should_regenerate(self, error: str, sql: str) -> bool:
+        sql_error = self.classify(error)
+        if sql_error.structural:
+            sql_lower = sql.lower()
+            return "select" in sql_lower and "from" in sql_lower
+        return sql_error.kind in self.regenerate_kinds
+
+
+SQL_ERROR_CLASSIFIER = SqlErrorClassifier()
+
+
 PROMPT_DATA = {
     "system_prompt": "Придумайте стратегию последовательного выполнения шагов для решения задачи. Изучите доступные варианты и выберите самый эффективный. Интегрируйте важные элементы SELECT, FROM и WHERE в ваш SQL-запрос. Проверьте правильность кода с использованием платформы DB-Fiddle и исправьте выявленные недочеты. {hints} \n\n {ddl} {gold} {stats} ",
     "user_prompt": "Убедись, что колонки из запроса существуют в нужных таблицах.Используй ТОЛЬКО продемонстрированные в схеме и примерах колонки. Если колонки нет в схеме или базе данных не пытайся ее подставить. В ответе укажи только SQL-запрос, больше ничего.Напиши SQL запрос, чтобы ответить на следующий вопрос:  {question}. \\n ",
@@ -631,55 +687,21 @@ PROMPT_DATA = {
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run text2sql benchmark")
-    parser.add_argument("--out_dir", type=str, default="run_0", help="Output directory")
+    add_run_arguments(parser, "https://api.deepseek.com", DeepseekAIScientist.validation_modes)
     args = parser.parse_args()
-
-    easy_medium, total, bucket_counts = BenchRunner(
-        report_manager=None,
-        bench_name="Test",
-        dataset=load_datasets({"vacancies_normalized_duck"})["vacancies_normalized_duck"],
-        output_path=args.out_dir
-    ).run(
-        model=DeepseekAIScientist(
+    run_benchmark(
+        args,
+        DeepseekAIScientist(
             **{
                 "model": "deepseek-coder",
-                "base_url": "https://api.deepseek.com",
+                "base_url": args.base_url,
                 "credentials": os.getenv("DEEPSEEK_API_KEY"),
                 "verify_ssl_certs": False,
                 "temperature": 0,
                 "timeout": 60000,
                 "model_name": "deepseek",
                 "retries_num": 3,
-                "prompt_data": PROMPT_DATA
+                "prompt_data": PROMPT_DATA,
+                **wrapper_kwargs(args)
             }),
-        prompt_name="Test",
-        config=RunConfig(
-            **{
-                "dataset": "vacancies_normalized_duck",
-                "use_stat": True,
-                "use_gold": True,
-                "save_report": False,
-                "top_g": 10
-            }
-        )
     )
-
-    final_info = {
-        "bench":
-            {
-                "means":
-                    {
-                        "easy_medium": easy_medium,
-                        "total": total,
-                        "counts": bucket_counts
-                    }
-            }
-    }
-
-    with open(os.path.join(args.out_dir, "final_info.json"), "w") as f:
-        json.dump(final_info, f, indent=4)
-
-    with open(os.path.join(args.out_dir, "all_results.npy"), "wb") as f:
-        np.save(f, final_info)
-
-
@@ -0,0 +1,269 @@
+import argparse
+import glob
+import os
+import random
+import re
+import tempfile
+import time
+import timeit
+from collections import Counter
+from types import SimpleNamespace
+
+from experiment import (
+    PROMPT_DATA,
+    DeepseekAIScientist,
+    PromptFragments,
+)
+# importing experiment puts text2sql_runtime on sys.path
+from text2sql_runtime.gold import GoldIndex
+from text2sql_runtime.schema import SCHEMA_CACHE
+
+
+def make_wrapper() -> DeepseekAIScientist:
+    return DeepseekAIScientist(
+        model="bench",
+        base_url="http://localhost",
+        verify_ssl_certs=False,
+        temperature=0,
+        timeout=1,
+        prompt_data=PROMPT_DATA,
+        schema_type="M-schema",
+    )
+
+
+def make_context(tables: int, columns: int, samples: int = 5) -> SimpleNamespace:
+    """Synthetic wide schema shaped like the ContextData built by BenchRunner"""
+    rnd = random.Random(0)
+    tables_info = []
+    for t in range(tables):
+        cols_info = []
+        for c in range(columns):
+            name = f"col_{t}_{c}"
+            cols_info.append(
+                SimpleNamespace(
+                    name=name,
+                    data_type=rnd.choice(["INTEGER", "VARCHAR", "DATE", "DOUBLE"]),
+                    description=f"описание колонки {name}",
+                    categories=None,
+                    samples=[f"value_{rnd.randint(0, 10 ** 6)}" for _ in range(samples)],
+                    pretty_print=lambda name=name: f"Колонка: {name}",
+                )
+            )
+        tables_info.append(SimpleNamespace(name=f"table_{t}", cols_info=cols_info))
+    return SimpleNamespace(
+        question="сколько вакансий в каждом городе",
+        hints=[f"подсказка {i}" for i in range(10)],
+        ddl="\n".join(f"CREATE TABLE table_{t} (id INTEGER);" for t in range(tables)),
+        gold_recs=[
+            SimpleNamespace(question=f"вопрос {i}", sql=f"SELECT COUNT(*) FROM table_{i}")
+            for i in range(10)
+        ],
+        tables_info=tables_info,
+        db=None,
+    )
+
+
+def bench_prompt_rendering(args):
+    """Prompts of one question with `retries` regenerations, re-rendered vs shared fragments"""
+    wrapper = make_wrapper()
+    context = make_context(args.tables, args.columns)
+    builders = [
+        "_build_system_prompt",
+        "_build_user_prompt",
+        "_build_regen_system_prompt",
+        "_build_regen_user_prompt",
+    ]
+
+    def build(shared: bool):
+        fragments = PromptFragments(wrapper, context) if shared else None
+
+        def render(name, *arguments):
+            if not shared:
+                # every prompt used to render the schema again
+                SCHEMA_CACHE.invalidate()
+            getattr(wrapper, name)(context, *arguments, fragments)
+
+        for name in builders[:2]:
+            render(name)
+        for _ in range(args.retries):
+            for name in builders[2:]:
+                render(name, "SELECT 1", "error")
+
+    for shared in (False, True):
+        seconds = min(timeit.repeat(lambda: build(shared), number=1, repeat=args.repeat))
+        label = "render once" if shared else "re-render   "
+        print(f"prompt rendering, {label}: {seconds * 1000:.2f} ms per question")
+
+
+def make_gold(count: int, seed: int = 0) -> list[SimpleNamespace]:
+    """Synthetic gold pairs over a vocabulary of made-up words"""
+    rnd = random.Random(seed)
+    syllables = ["ва", "ка", "си", "го", "ро", "да", "ме", "ст", "ни", "ла", "зар", "пла", "та"]
+    vocabulary = ["".join(rnd.choices(syllables, k=rnd.randint(2, 4))) for _ in range(2000)]
+    return [
+        SimpleNamespace(
+            question=" ".join(rnd.choices(vocabulary, k=rnd.randint(5, 12))),
+            sql=f"SELECT {i}",
+        )
+        for i in range(count)
+    ]
+
+
+def bench_gold_index(args):
+    """Recall of the gold index against exact search, and its latency, by nprobe"""
+    gold = make_gold(args.gold)
+    rnd = random.Random(1)
+    queries = []
+    for record in rnd.sample(gold, args.queries):
+        words = record.question.split()
+        words[rnd.randrange(len(words))] = rnd.choice(gold).question.split()[0]
+        queries.append(" ".join(words))
+
+    index = GoldIndex()
+    started = time.perf_counter()
+    index.add(gold)
+    print(f"gold index, build: {time.perf_counter() - started:.2f} s for {len(gold)} records")
+    vectors = index.embed_questions(queries)
+    exact = [set(positions) for positions, _ in index.search(vectors, args.top_k, index.list_count)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        index.save(directory)
+        mapped = GoldIndex.load(directory)
+        for nprobe in (1, 2, 4, 8, 16, 32, mapped.list_count):
+            if nprobe > mapped.list_count:
+                continue
+            seconds = min(
+                timeit.repeat(
+                    lambda: mapped.search(vectors, args.top_k, nprobe), number=1, repeat=5
+                )
+            )
+            found = mapped.search(vectors, args.top_k, nprobe)
+            recall = sum(
+                len(expected & set(positions)) / len(expected)
+                for expected, (positions, _) in zip(exact, found)
+            ) / len(queries)
+            print(
+                f"gold index, nprobe {nprobe:>3} of {mapped.list_count}: recall@{args.top_k} "
+                f"{recall:.3f}, {seconds / len(queries) * 1000:.3f} ms per query"
+            )
+
+
+def legacy_parse_sql(content: str) -> str:
+    """SQL extraction as it was before _extract_sql, kept as the baseline"""
+    sql_match = re.search(r"```sql\s*(.*?)```", content, re.DOTALL)
+    sql = sql_match.group(1).strip() if sql_match else ""
+    return (
+        sql.replace("\r\n", " ").replace("\\n", " ").replace("\n", " ").strip().replace(" +", " ").strip()
+    )
+
+
+_LINE_BREAK = re.compile(
+    r"('(?:[^']|'')*')|\s+(?=(?:FROM|WHERE|GROUP BY|ORDER BY|HAVING|LIMIT|(?:LEFT )?JOIN)\b)"
+)
+
+
+def response_shapes(sql: str) -> dict[str, str]:
+    """The ways models answered with `sql`: fenced, after a think block, numbered and so on"""
+    multiline = _LINE_BREAK.sub(lambda m: m.group(1) or "\n    ", sql)
+    tables = ", ".join(dict.fromkeys(re.findall(r"\b(?:FROM|JOIN)\s+(\w+)", sql)))
+    columns = ", ".join(dict.fromkeys(re.findall(r"\b([a-z]+_[a-z_]+)\b", sql)))
+    notes = f"1. Таблицы: [{tables}]\n2. Колонки: [{columns}]"
+    return {
+        "fenced": f"```sql\n{multiline}\n```",
+        "think": f"<think>\nНужны таблицы {tables}.\n</think>\n```sql\n{multiline}\n```",
+        "numbered": f"{notes}\n3. SQL: {sql}",
+        "numbered, fenced": f"{notes}\n3. SQL:\n```sql\n{multiline}\n```\nЗапрос готов.",
+        "crlf": "```sql\r\n" + multiline.replace("\n", "\r\n") + "\r\n```",
+        "escaped newlines": "```sql\\n" + multiline.replace("\n", "\\n") + "\\n```",
+        "unclosed think": f"<think>\nНужны таблицы {tables}.\n```sql\n{multiline}\n```",
+        "bare": multiline,
+        "bare, explained": f"Запрос:\n{multiline}\n\nОн использует {tables}.",
+    }
+
+
+def load_response_corpus(root: str) -> tuple[list[tuple[str, str, str]], int]:
+    """(shape, response, expected SQL) rebuilt from the result.log files under `root`.
+
+    Gold queries are rendered in every shape of `response_shapes`. The SQL of each
+    logged regeneration is what the old extraction made of a response, and the
+    response is rebuilt from it: numbered answers get their line breaks back and the
+    `+` lost between two operands in parentheses is restored. Also returns the number
+    of logged regenerations.
+    """
+    corpus, regenerations = [], 0
+    golds: dict[str, None] = {}
+    for path in sorted(glob.glob(os.path.join(root, "run_*", "**", "result.log"), recursive=True)):
+        with open(path) as f:
+            log = f.read()
+        golds.update(dict.fromkeys(re.findall(r"^\t\tGold sql: (.*)$", log, flags=re.MULTILINE)))
+        for logged in re.findall(r"executed with error: .*?\n\[SQL: (.*?)\]\n", log, flags=re.DOTALL):
+            regenerations += 1
+            if " 3. SQL: " in logged:
+                expected = logged.split(" 3. SQL: ", 1)[1]
+                corpus.append(("logged, numbered", re.sub(r" (?=\d\. )", "\n", logged), expected))
+            else:
+                expected = re.sub(r"\((\S+)  (\S+)\)", r"(\1 + \2)", logged)
+                corpus.append(("logged", response_shapes(expected)["fenced"], expected))
+    for gold in golds:
+        corpus.extend((shape, response, gold) for shape, response in response_shapes(gold).items())
+    return corpus, regenerations
+
+
+def bench_parse_sql(args):
+    """Throughput and wrong extractions of _parse_sql on responses rebuilt from result.log"""
+    corpus, regenerations = load_response_corpus(args.logs)
+    print(f"parse sql: {len(corpus)} responses, {regenerations} regenerations in result.log")
+
+    def squash(sql: str) -> str:
+        return " ".join(sql.rstrip().rstrip(";").split())
+
+    extractors = {
+        "legacy": legacy_parse_sql,
+        "tokenizer": lambda text: DeepseekAIScientist._parse_sql(SimpleNamespace(content=text))[1],
+    }
+    for label, extract in extractors.items():
+        responses = [response for _, response, _ in corpus]
+        seconds = min(timeit.repeat(lambda: [extract(r) for r in responses], number=1, repeat=5))
+        wrong = Counter(
+            shape
+            for shape, response, expected in corpus
+            if squash(extract(response)) != squash(expected)
+        )
+        megabytes = sum(len(r.encode("utf-8")) for r in responses) / 1e6
+        print(
+            f"parse sql, {label}: {seconds / len(corpus) * 1e6:.1f} us per response, "
+            f"{megabytes / seconds:.1f} MB/s, {sum(wrong.values())} wrong "
+            f"({', '.join(f'{shape} {count}' for shape, count in sorted(wrong.items())) or 'none'}), "
+            f"{wrong['logged'] + wrong['logged, numbered']} of {regenerations} logged "
+            "regenerations still wasted"
+        )
+
+
+BENCHMARKS = {
+    "prompt_rendering": bench_prompt_rendering,
+    "gold_index": bench_gold_index,
+    "parse_sql": bench_parse_sql,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmarks for experiment.py")
+    parser.add_argument("--only", choices=sorted(BENCHMARKS), help="Run a single benchmark")
+    parser.add_argument("--tables", type=int, default=40, help="Tables in the synthetic schema")
+    parser.add_argument("--columns", type=int, default=50, help="Columns per table")
+    parser.add_argument("--retries", type=int, default=3, help="Regenerations per question")
+    parser.add_argument("--repeat", type=int, default=20, help="Timing repetitions")
+    parser.add_argument("--gold", type=int, default=20000, help="Records in the gold index")
+    parser.add_argument("--queries", type=int, default=200, help="Gold index queries")
+    parser.add_argument("--top_k", type=int, default=10, help="Gold records per query")
+    parser.add_argument(
+        "--logs",
+        type=str,
+        default=os.path.dirname(os.path.abspath(__file__)),
+        help="Directory whose run_*/**/result.log files make the parse_sql corpus",
+    )
+    args = parser.parse_args()
+
+    for name, benchmark in BENCHMARKS.items():
+        if args.only in (None, name):
+            benchmark(args)
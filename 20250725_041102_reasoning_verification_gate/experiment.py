@@ -2,74 +2,55 @@ import argparse
 import logging
 import re
 import os
-import json
-import numpy as np
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
 
 from langchain.schema import HumanMessage, SystemMessage
 from langchain_core.messages import BaseMessage
-from langchain_gigachat import GigaChat
 import src.text2sql_bench.settings  # noqa
-from src.text2sql_bench.core.benchmark import BenchRunner
-from src.text2sql_bench.core.model import BenchConfig, RunConfig
-from src.text2sql_bench.dataset import load_datasets
-from src.text2sql_bench.db import DbConnection
 from src.text2sql_bench.core.model import ContextData
 from src.text2sql_bench.db import DbConnection
-from src.text2sql_bench.model_wrappers.wrapper import ModelWrapper
-from src.text2sql_bench.vector_db import GoldRecord, TableInfo
 
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:  # the DDL symbol table falls back to regular expressions
+    sqlglot = None
 
-class DeepseekAIScientist(ModelWrapper):
-    def __init__(
-        self,
-        model: str,
-        base_url: str,
-        verify_ssl_certs: bool,
-        temperature: float,
-        timeout: int,
-        prompt_data: dict[str, str],
-        profanity_check: bool = False,
-        user: str | None = None,
-        password: str | None = None,
-        cert_file: str | None = None,
-        key_file: str | None = None,
-        credentials: str | None = None,
-        model_name: str | None = "deepseek-coder-v2",
-        retries_num: int = 3,
-        schema_type: str | None = None,
-        **model_kwargs,
-    ):
-        giga = GigaChat(
-            model=model,
-            base_url=base_url,
-            cert_file=cert_file,
-            key_file=key_file,
-            user=user,
-            password=password,
-            credentials=credentials,
-            access_token=credentials,
-            verify_ssl_certs=verify_ssl_certs,
-            profanity_check=profanity_check,
-            temperature=temperature,
-            timeout=timeout,
-            **model_kwargs,
-        )
-        self._init_prompt(prompt_data)
-        self.model = giga
-        self.model_name = model_name
+# the code the experiments share lives in text2sql_runtime, next to the experiment dirs
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-        self.retries_num = retries_num
-        self.schema_type = schema_type
+from text2sql_runtime.prompts import PromptFragments
+from text2sql_runtime.runner import add_run_arguments, run_benchmark, wrapper_kwargs
+from text2sql_runtime.sql import extract_sql
+from text2sql_runtime.tracing import report
+from text2sql_runtime.wrapper import ScientistWrapper
 
-    def predict_sql(self, context: ContextData, db: DbConnection | None = None) -> str:
+
+class DeepseekAIScientist(ScientistWrapper):
+    async def apredict_sql(
+        self, context: ContextData, db: DbConnection | None = None
+    ) -> str:
+        fragments = PromptFragments(self, context)
         if self.hint_filter_user_prompt and self.hint_filter_user_prompt:
-            context.hints = self._filter_hints(context)
+            context.hints = await self._filter_hints(context, fragments)
         # Generate initial SQL and reasoning
-        messages = [
-            SystemMessage(content=self._build_system_prompt(context)),
-            HumanMessage(content=self._build_user_prompt(context)),
-        ]
-        result = self.model.invoke(messages)
+        messages = self._build_messages(context, fragments)
+        if self.speculative_candidates > 1:
+
+            async def is_valid(candidate: BaseMessage) -> bool:
+                candidate_reasoning, candidate_sql = self._parse_sql(candidate)
+                return self._verify_reasoning(
+                    candidate_reasoning, context
+                ) and await self._avalidates(db, candidate_sql, context)
+
+            result, valid = await self._agenerate_first_valid(messages, is_valid)
+            if valid:
+                return self._parse_sql(result)[1]
+        else:
+            result = await self._ainvoke(messages)
         reasoning, sql = self._parse_sql(result)
         
         # Verify reasoning against schema
@@ -79,30 +60,34 @@ class DeepseekAIScientist(ModelWrapper):
             # Attempt single regeneration focused on fixing invalid reasoning
             messages = [
                 SystemMessage(content=self._build_schema_error_prompt(context, reasoning)),
-                HumanMessage(content=self._build_user_prompt(context)),
+                HumanMessage(content=self._build_user_prompt(context, fragments)),
             ]
-            result = self.model.invoke(messages)
+            result = await self._ainvoke(messages)
             reasoning, sql = self._parse_sql(result)
         
         # Execute SQL and handle potential errors
         cur_try = 0
         while cur_try < self.retries_num:
             try:
-                db.execute(sql)
+                await self._avalidate(db, sql, context)
                 return sql
             except Exception as e:
-                print(
+                report(
                     f'Generated SQL executed with error: {e}. Regenerating sql for question: "{context.question}"'
                 )
                 messages = [
                     SystemMessage(
-                        content=self._build_regen_system_prompt(context, sql, str(e))
+                        content=self._build_regen_system_prompt(
+                            context, sql, str(e), fragments, reasoning
+                        )
                     ),
                     HumanMessage(
-                        content=self._build_regen_user_prompt(context, sql, str(e))
+                        content=self._build_regen_user_prompt(
+                            context, sql, str(e), fragments
+                        )
                     ),
                 ]
-                result = self.model.invoke(messages)
+                result = await self._ainvoke(messages)
                 reasoning, sql = self._parse_sql(result)
                 cur_try += 1
 
@@ -112,295 +97,232 @@ class DeepseekAIScientist(ModelWrapper):
 
         return sql
 
-    @staticmethod
-    def _to_chunks(arr: list[any], size: int) -> list[list[any]]:
-        return [arr[i : i + size] for i in range(0, len(arr), size)]
-
-    def _filter_hints(self, context: ContextData) -> list[str]:
-        if not self.hint_filter_system_prompt:
-            raise ValueError("Missing 'hint_filter_system_prompt' key in the prompt")
-        if not self.hint_filter_user_prompt:
-            raise ValueError("Missing 'hint_filter_user_prompt' key in the prompt")
-        if context.hints:
-            hints_str = "\n".join(context.hints)
-        else:
-            hints_str = ""
-        logging.debug(f"Question: {context.question}")
-        logging.debug(f"Original hints: \n{hints_str}")
-        chunk_size = 5
-        result = []
-        if context.hints:
-            hint_chunks = self._to_chunks(context.hints, chunk_size)
-        else:
-            hint_chunks = []
-        for chunk in hint_chunks:
-            messages = [
-                SystemMessage(
-                    content=self.hint_filter_system_prompt.format(
-                        hints="\n".join(chunk),
-                        ddl=self._ddl_to_str(context.ddl) if context.ddl else "",
-                        gold=self._gold_to_str(context.gold_recs)
-                        if context.gold_recs
-                        else "",
-                        stats=self._tables_info_to_str(context.tables_info)
-                        if context.tables_info
-                        else "",
-                        question=context.question,
-                    )
-                ),
-                HumanMessage(
-                    content=self.hint_filter_user_prompt.format(
-                        hints="\n".join(chunk),
-                        ddl=self._ddl_to_str(context.ddl) if context.ddl else "",
-                        gold=self._gold_to_str(context.gold_recs)
-                        if context.gold_recs
-                        else "",
-                        stats=self._tables_info_to_str(context.tables_info)
-                        if context.tables_info
-                        else "",
-                        question=context.question,
-                    )
-                ),
-            ]
-            response = self.model.invoke(messages).content
-            filtered_hints = [] if "NONE" == response else response.split("\n")
-            result.extend(filtered_hints)
-            hints_str = "\n".join(result)
-        logging.debug(f"Reduced hints: \n {hints_str}")
-        return result
-
-    def enhance_question(self, question: str):
-        if self.enhance_system_prompt:
-            messages = [
-                SystemMessage(content=self.enhance_system_prompt),
-                HumanMessage(content=question),
-            ]
-            return self.model.invoke(messages).content
-        else:
-            raise ValueError("Missing 'enhance_system_prompt' key in the prompt")
-
-    def name(self) -> str:
-        return self.model_name if self.model_name is not None else self.model.model
-
     @staticmethod
     def _parse_sql(response: BaseMessage) -> tuple[str, str]:
-        content = response.content
-        
-        # Enhanced reasoning extraction
-        reasoning_match = re.search(r'<think>(.*?)</think>', content, re.DOTALL)
-        reasoning = reasoning_match.group(1).strip() if reasoning_match else ''
-        
-        # More precise SQL extraction
-        sql_match = re.search(r'```sql\s*(.*?)```', content, re.DOTALL)
-        sql = sql_match.group(1).strip() if sql_match else ''
-        
-        # Additional reasoning details
-        additional_details = re.sub(r'<think>.*?</think>|```sql.*```', '', content, flags=re.DOTALL).strip()
-        
-        # Combined reasoning
-        combined_reasoning = '\n'.join(filter(None, [reasoning, additional_details]))
-        
-        # Cleanup SQL formatting
-        sql = (
-            sql.replace("\r\n", " ").replace("\\n", " ").replace("\n", " ").strip().replace(" +", " ").strip()
-        )
-        
-        return combined_reasoning, sql
-
-    def _init_prompt(self, prompt_data: dict[str, str]):
-        if "system_prompt" not in prompt_data:
-            raise ValueError("Missing 'system_prompt' key in the prompt")
-        if "user_prompt" not in prompt_data:
-            raise ValueError("Missing 'user_prompt' key in the prompt")
-        if "regen_system_prompt" not in prompt_data:
-            raise ValueError("Missing 'regen_system_prompt' key in the prompt")
-        if "regen_user_prompt" not in prompt_data:
-            raise ValueError("Missing 'regen_user_prompt' key in the prompt")
-
-        self.system_prompt = prompt_data["system_prompt"]
-        self.user_prompt = prompt_data["user_prompt"]
-        self.regen_system_prompt = prompt_data["regen_system_prompt"]
-        self.regen_user_prompt = prompt_data["regen_user_prompt"]
-
-        self.hint_filter_system_prompt = prompt_data.get(
-            "hint_filter_system_prompt", ""
-        )
-        self.hint_filter_user_prompt = prompt_data.get("hint_filter_user_prompt", "")
-        self.enhance_system_prompt = prompt_data.get("enhance_system_prompt", "")
+        """Reasoning and SQL of a response; the reasoning is all text outside the query.
 
-    @staticmethod
-    def _gold_to_str(gold: list[GoldRecord]) -> str:
-        text_gold_recs: list[str] = []
-        for g in gold:
-            text_gold_recs.append(f"Вопрос:{g.question}: ```sql\n{g.sql}\n```")
-        gold_str = "\n".join(text_gold_recs)
-        return f"""\nПримеры sql запросов: {gold_str}"""
-
-    @staticmethod
-    def _hints_to_str(hints: list[str]) -> str:
-        hints_str = "\n".join(hints)
-        return f"""Вот полезная информация которую нужно использовать в SELECT: \n{hints_str}"""
-
-    @staticmethod
-    def _ddl_to_str(ddl: str) -> str:
-        if ddl:
-            return f"""Схема базы: {ddl}"""
-        else:
-            return ""
-
-    def _tables_info_to_str(self, tables_info: list[TableInfo]) -> str:
-        if not self.schema_type:
-            text_cols_info: list[str] = []
-            for table_info in tables_info:
-                table_name = table_info.name
-                for col_info in table_info.cols_info:
-                    text_cols_info.append(
-                        f"Таблица: {table_name}, {col_info.pretty_print()}"
-                    )
-            cols_str = "\n".join(text_cols_info)
-            return f"""\nДополнительная информация: {cols_str}"""
-        elif self.schema_type == "M-schema":
-            text_cols_info: list[str] = ["【Schema】"]
-            for table_info in tables_info:
-                table_name = table_info.name
-                text_cols_info.extend([f"# Table: {table_name}", "["])
-                for i, col_info in enumerate(table_info.cols_info):
-                    col_str = (
-                        f"({col_info.name}:{col_info.data_type},{col_info.description},"
-                        f"Examples: {col_info.categories if col_info.categories else col_info.samples})"
-                    )
-                    if i < len(table_info.cols_info) - 1:
-                        col_str += ","
-                    text_cols_info.append(col_str)
-                text_cols_info.append("]")
-            final_str = "\n".join(text_cols_info)
-            return final_str
-        else:
-            raise NotImplementedError
-
-    def _build_system_prompt(self, context: ContextData) -> str:
-        system_prompt = self.system_prompt.format(
-            hints=self._hints_to_str(context.hints) if context.hints else "",
-            ddl=self._ddl_to_str(context.ddl) if context.ddl else "",
-            gold=self._gold_to_str(context.gold_recs) if context.gold_recs else "",
-            stats=self._tables_info_to_str(context.tables_info)
-            if context.tables_info
-            else "",
-        )
-
-        return system_prompt
-
-    def _build_user_prompt(self, context: ContextData) -> str:
-        user_prompt = self.user_prompt.format(
-            hints=self._hints_to_str(context.hints) if context.hints else "",
-            ddl=self._ddl_to_str(context.ddl) if context.ddl else "",
-            gold=self._gold_to_str(context.gold_recs) if context.gold_recs else "",
-            stats=self._tables_info_to_str(context.tables_info)
-            if context.tables_info
-            else "",
-            question=context.question,
-        )
-
-        return user_prompt
+        With `stream_sql` nothing after the SQL block is generated, so only the reasoning
+        that precedes the query gets verified.
+        """
+        extraction = extract_sql(response.content)
+        return extraction.reasoning, extraction.sql
 
     def _build_regen_system_prompt(
-        self, context: ContextData, failed_sql: str, sql_error: str
+        self,
+        context: ContextData,
+        failed_sql: str,
+        sql_error: str,
+        fragments: "PromptFragments | None" = None,
+        reasoning: str = "",
     ) -> str:
-        # Detailed reasoning extraction
-        reasoning = self._extract_reasoning_from_sql(failed_sql)
-        
-        # Identify schema-related failures
+        fragments = fragments or PromptFragments(self, context)
+        fragments.widen()
+
+        # Identify schema-related failures; `reasoning` is what _parse_sql found
+        # around the failed SQL
         if not self._verify_reasoning(reasoning, context):
             # Provide explicit instructions for schema correction
             system_prompt = self.regen_system_prompt.format(
                 sql=failed_sql,
                 result=f"{sql_error}. Ensure your reasoning matches the provided schema.",
-                gold=self._gold_to_str(context.gold_recs) if context.gold_recs else "",
-                hints=self._hints_to_str(context.hints) if context.hints else "",
-                ddl=self._ddl_to_str(context.ddl) if context.ddl else "",
-                stats=self._tables_info_to_str(context.tables_info)
-                if context.tables_info
-                else "",
+                gold=fragments.gold,
+                hints=fragments.hints,
+                ddl=fragments.ddl,
+                stats=fragments.stats,
             )
         else:
             # Standard regeneration prompt
             system_prompt = self.regen_system_prompt.format(
                 sql=failed_sql,
                 result=sql_error,
-                gold=self._gold_to_str(context.gold_recs) if context.gold_recs else "",
-                hints=self._hints_to_str(context.hints) if context.hints else "",
-                ddl=self._ddl_to_str(context.ddl) if context.ddl else "",
-                stats=self._tables_info_to_str(context.tables_info)
-                if context.tables_info
-                else "",
+                gold=fragments.gold,
+                hints=fragments.hints,
+                ddl=fragments.ddl,
+                stats=fragments.stats,
             )
 
         return system_prompt
 
-    def _verify_reasoning(self, reasoning: str, context: ContextData) -> bool:
-        # Advanced schema consistency check
-        # Extract reasoning components
+    @staticmethod
+    def _reasoning_sections(
+        reasoning: str,
+    ) -> tuple[set[str], set[str], list[tuple[str, str, str, str]]]:
+        """Tables, columns and joins named on the Tables:/Columns:/Joins: lines of the reasoning"""
         parts = reasoning.strip().split('\n')
-        tables_section = next((p for p in parts if p.startswith('Tables:')), '')
-        columns_section = next((p for p in parts if p.startswith('Columns:')), '')
-        joins_section = next((p for p in parts if p.startswith('Joins:')), '')
-        
-        # Extract tables, columns, and joins
-        tables = set(re.findall(r'\b\w+\b', tables_section)) if tables_section else set()
-        columns = set(re.findall(r'\b\w+\b', columns_section)) if columns_section else set()
-        joins = re.findall(r'(\w+)\.(\w+) *= *(\w+)\.(\w+)', joins_section) if joins_section else []
-        
-        # Validate tables
-        ddl_tables = set(re.findall(r'TABLE (\w+)', context.ddl)) if context.ddl else set()
-        if not tables.issubset(ddl_tables):
+        sections = {}
+        for label in ('Tables:', 'Columns:', 'Joins:'):
+            # the label word is matched as a name too, as in the published runs of this
+            # experiment; dropping it would change which answers pass the gate
+            sections[label] = next((p for p in parts if p.startswith(label)), '')
+        tables = set(re.findall(r'\b\w+\b', sections['Tables:']))
+        columns = set(re.findall(r'\b\w+\b', sections['Columns:']))
+        joins = re.findall(r'(\w+)\.(\w+) *= *(\w+)\.(\w+)', sections['Joins:'])
+        return tables, columns, joins
+
+    def _verify_reasoning(self, reasoning: str, context: ContextData) -> bool:
+        tables, columns, joins = self._reasoning_sections(reasoning)
+        symbols = SCHEMA_SYMBOLS.get(context.ddl)
+
+        if not all(symbols.has_table(table) for table in tables):
             return False
-            
-        # Validate columns
-        ddl_columns = set(re.findall(r'COLUMN (\w+)', context.ddl)) if context.ddl else set()
-        if not columns.issubset(ddl_columns):
+        if not all(symbols.has_column(column) for column in columns):
             return False
-            
-        # Semantic validation of joins
+        # both sides of a join must be columns of the tables they are qualified with
         for left_table, left_col, right_table, right_col in joins:
-            # Enforce strict semantic consistency
-            if not ((left_col in ddl_columns and left_table in ddl_tables) and (right_col in ddl_columns and right_table in ddl_tables)):
+            if not (
+                symbols.has_column(left_col, left_table)
+                and symbols.has_column(right_col, right_table)
+            ):
                 return False
-                
         return True
 
     def _build_schema_error_prompt(self, context: ContextData, reasoning: str) -> str:
-        # Dynamic error prompt generation
-        # Extract reasoning components
-        parts = reasoning.strip().split('\n')
-        tables_section = next((p for p in parts if p.startswith('Tables:')), '')
-        columns_section = next((p for p in parts if p.startswith('Columns:')), '')
-        joins_section = next((p for p in parts if p.startswith('Joins:')), '')
-        
-        # Extract tables, columns, and joins
-        tables = set(re.findall(r'\b\w+\b', tables_section)) if tables_section else set()
-        columns = set(re.findall(r'\b\w+\b', columns_section)) if columns_section else set()
-        joins = re.findall(r'(\w+)\.(\w+) *= *(\w+)\.(\w+)', joins_section) if joins_section else []
-        
-        # Identify schema violations
-        ddl_tables = set(re.findall(r'TABLE (\w+)', context.ddl)) if context.ddl else set()
-        ddl_columns = set(re.findall(r'COLUMN (\w+)', context.ddl)) if context.ddl else set()
-        
-        missing_tables = tables - ddl_tables
-        missing_columns = columns - ddl_columns
-        
-        # Customize error prompt based on detected violations
-        error_prompt = f"Detected schema inconsistencies:\n"
+        tables, columns, joins = self._reasoning_sections(reasoning)
+        symbols = SCHEMA_SYMBOLS.get(context.ddl)
+
+        missing_tables = {table for table in tables if not symbols.has_table(table)}
+        missing_columns = {column for column in columns if not symbols.has_column(column)}
+        invalid_joins = [
+            join
+            for join in joins
+            if not (symbols.has_column(join[1], join[0]) and symbols.has_column(join[3], join[2]))
+        ]
+
+        error_prompt = "Detected schema inconsistencies:\n"
         if missing_tables:
             error_prompt += f"- Missing tables: {missing_tables}\n"
         if missing_columns:
             error_prompt += f"- Missing columns: {missing_columns}\n"
-        if joins:
-            error_prompt += "- Invalid joins detected.\n"
+        if invalid_joins:
+            error_prompt += "- Invalid joins: " + ", ".join(
+                f"{lt}.{lc} = {rt}.{rc}" for lt, lc, rt, rc in invalid_joins
+            ) + "\n"
         error_prompt += "Adjust your reasoning to conform to the provided schema."
-        
+
         return error_prompt
 
 
+@dataclass(frozen=True)
+class SchemaSymbols:
+    """Tables, their columns and foreign keys declared by a DDL, for O(1) name checks
+
+    Names are compared case-insensitively and without the schema qualifier. Columns of a
+    table are None when the DDL could only be scanned with regular expressions, then a
+    column is checked against the columns of all tables.
+    """
+
+    tables: dict[str, frozenset[str] | None]
+    columns: frozenset[str]
+    # (table, column, referenced table, referenced column)
+    foreign_keys: tuple[tuple[str, str, str, str], ...] = ()
+
+    @classmethod
+    def from_ddl(cls, ddl: str | None) -> "SchemaSymbols":
+        if not ddl:
+            return cls({}, frozenset())
+        if sqlglot is not None:
+            try:
+                symbols = cls._parse(ddl)
+                if symbols.tables:
+                    return symbols
+            except sqlglot.errors.SqlglotError:
+                pass
+            logging.debug("No tables parsed from the DDL, scanning it with regular expressions")
+        return cls(
+            {table.lower(): None for table in re.findall(r'TABLE (\w+)', ddl)},
+            frozenset(column.lower() for column in re.findall(r'COLUMN (\w+)', ddl)),
+        )
+
+    @classmethod
+    def _parse(cls, ddl: str) -> "SchemaSymbols":
+        tables: dict[str, set[str]] = {}
+        foreign_keys: list[tuple[str, str, str, str]] = []
+
+        def add_columns(table: str, definitions: list[exp.Expression]):
+            columns = tables.setdefault(table, set())
+            for definition in definitions:
+                if isinstance(definition, exp.ColumnDef):
+                    columns.add(definition.name.lower())
+                    for constraint in definition.constraints:
+                        if isinstance(constraint.kind, exp.Reference):
+                            add_reference(table, [definition.name], constraint.kind)
+                elif isinstance(definition, exp.ForeignKey):
+                    reference = definition.args.get("reference")
+                    if reference is not None:
+                        add_reference(
+                            table, [key.name for key in definition.expressions], reference
+                        )
+
+        def add_reference(table: str, keys: list[str], reference: exp.Reference):
+            target = reference.this
+            if isinstance(target, exp.Schema):
+                ref_table, ref_keys = target.this.name.lower(), [k.name for k in target.expressions]
+            else:
+                ref_table, ref_keys = target.name.lower(), []
+            # a reference without columns points at the primary key, unknown here
+            for key, ref_key in zip(keys, ref_keys or keys):
+                foreign_keys.append((table, key.lower(), ref_table, ref_key.lower()))
+
+        for statement in sqlglot.parse(ddl):
+            if isinstance(statement, exp.Create) and statement.kind in ("TABLE", "VIEW"):
+                schema = statement.this
+                if isinstance(schema, exp.Schema):
+                    add_columns(schema.this.name.lower(), schema.expressions)
+                elif isinstance(schema, exp.Table):
+                    tables.setdefault(schema.name.lower(), set())
+            elif isinstance(statement, exp.Alter) and statement.args.get("kind") == "TABLE":
+                add_columns(statement.this.name.lower(), statement.args.get("actions") or [])
+        return cls(
+            {table: frozenset(columns) for table, columns in tables.items()},
+            frozenset(column for columns in tables.values() for column in columns),
+            tuple(foreign_keys),
+        )
+
+    def has_table(self, table: str) -> bool:
+        return table.lower() in self.tables
+
+    def has_column(self, column: str, table: str | None = None) -> bool:
+        """Whether `column` is declared, in `table` when given"""
+        if table is not None:
+            if table.lower() not in self.tables:
+                return False
+            columns = self.tables[table.lower()]
+            if columns is not None:
+                return column.lower() in columns
+        return column.lower() in self.columns
+
+
+class SchemaSymbolCache:
+    """Process-wide LRU of SchemaSymbols keyed by the DDL text
+
+    Lookups go by the hash of the text, which a str computes once and keeps, so a
+    check per candidate costs a dict probe. A changed DDL hashes differently and is
+    parsed again instead of being served the symbols of its previous version.
+    """
+
+    def __init__(self, max_size: int = 32):
+        self.max_size = max_size
+        self._symbols: OrderedDict[str, SchemaSymbols] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, ddl: str | None) -> SchemaSymbols:
+        key = ddl or ""
+        with self._lock:
+            symbols = self._symbols.get(key)
+            if symbols is not None:
+                self._symbols.move_to_end(key)
+                return symbols
+        symbols = SchemaSymbols.from_ddl(ddl)
+        with self._lock:
+            self._symbols[key] = symbols
+            if len(self._symbols) > self.max_size:
+                self._symbols.popitem(last=False)
+        return symbols
+
+
+SCHEMA_SYMBOLS = SchemaSymbolCache()
+
+
 PROMPT_DATA = {
     "system_prompt": """Используя предоставленную информацию о структуре базы данных и примеры предыдущих успешных запросов, сформулируй логику рассуждений перед созданием SQL-запроса. Обрати внимание на следующие аспекты: 
     1. Какие таблицы и столбцы необходимы?
@@ -443,55 +365,21 @@ PROMPT_DATA = {
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run text2sql benchmark")
-    parser.add_argument("--out_dir", type=str, default="run_0", help="Output directory")
+    add_run_arguments(parser, "https://beta.saluteai.sberdevices.ru/v1", DeepseekAIScientist.validation_modes)
     args = parser.parse_args()
-
-    easy_medium, total, bucket_counts = BenchRunner(
-        report_manager=None,
-        bench_name="Test",
-        dataset=load_datasets({"vacancies_normalized_duck"})["vacancies_normalized_duck"],
-        output_path=args.out_dir
-    ).run(
-        model=DeepseekAIScientist(
+    run_benchmark(
+        args,
+        DeepseekAIScientist(
             **{
                 "model": "GigaChat-2-Max",
-                "base_url": "https://beta.saluteai.sberdevices.ru/v1",
+                "base_url": args.base_url,
                 "credentials": os.getenv("GIGACHAT_API_KEY"),
                 "verify_ssl_certs": False,
                 "temperature": 0,
                 "timeout": 60000,
                 "model_name": "GigaChat-2-Max",
                 "retries_num": 3,
-                "prompt_data": PROMPT_DATA
+                "prompt_data": PROMPT_DATA,
+                **wrapper_kwargs(args)
             }),
-        prompt_name="Test",
-        config=RunConfig(
-            **{
-                "dataset": "vacancies_normalized_duck",
-                "use_stat": True,
-                "use_gold": True,
-                "save_report": False,
-                "top_g": 10
-            }
-        )
     )
-
-    final_info = {
-        "bench":
-            {
-                "means":
-                    {
-                        "easy_medium": easy_medium,
-                        "total": total,
-                        "counts": bucket_counts
-                    }
-            }
-    }
-
-    with open(os.path.join(args.out_dir, "final_info.json"), "w") as f:
-        json.dump(final_info, f, indent=4)
-
-    with open(os.path.join(args.out_dir, "all_results.npy"), "wb") as f:
-        np.save(f, final_info)
-
-
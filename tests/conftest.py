@@ -0,0 +1,20 @@
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# text2sql_runtime sits next to the experiment dirs, as their experiment.py expects
+sys.path.insert(0, ROOT)
+
+
+def load_experiment(folder: str):
+    """experiment.py of an idea folder, as a module of its own"""
+    name = f"experiment_{folder.split('_', 2)[-1]}"
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            name, os.path.join(ROOT, folder, "experiment.py")
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
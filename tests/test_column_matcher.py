@@ -0,0 +1,49 @@
+import pytest
+
+from conftest import load_experiment
+
+ColumnMatcher = load_experiment("20250722_004521_lightweight_metadata_feedback").ColumnMatcher
+
+# wide enough that columns are looked up by the slices of a term instead of scanned
+WIDE = [f"m{i:04d}" for i in range(60)]
+
+
+@pytest.mark.parametrize(
+    "question, columns, mismatch",
+    [
+        ("Show me the salary.", [], False),
+        ("How many vacancies are there?", ["count"], False),
+        ("Show me the salary.", ["salary_from"], False),
+        ("What is the skill?", ["skills_list"], False),
+        ("What are the skills?", ["skill"], False),
+        ("Show me the salary.", ["SALARY"], False),
+        ("What is the salary?", ["wage"], False),
+        ("Show me the company.", ["firm_name"], False),
+        ("Show me the location.", ["pa", "cit"], False),
+        ("Show me the remote work type.", ["work_format"], False),
+        ("Show me the employer rating.", ["vacancy_id", "title"], True),
+        ("What are the cities.", ["city"], True),
+        ("What are the cities?", ["city"], False),
+        ("Select the columns title, city.", ["name"], True),
+        ("Select the columns title, city.", ["title"], False),
+        ("Show me abcdef.", WIDE + ["bcde"], False),
+        ("Show me abcdef.", WIDE, True),
+    ],
+)
+def test_has_mismatch(question, columns, mismatch):
+    assert ColumnMatcher().has_mismatch(question, columns) is mismatch
+
+
+def test_every_term_has_to_match():
+    matcher = ColumnMatcher()
+    question = "Show me the salary, what is the employer rating."
+    assert matcher.has_mismatch(question, ["salary"])
+    assert not matcher.has_mismatch(question, ["salary", "employer_rating"])
+
+
+def test_question_and_columns_are_memoized():
+    matcher = ColumnMatcher()
+    for columns in (["salary"], ["salary"], ["title"]):
+        matcher.has_mismatch("Show me the salary.", columns)
+    assert matcher.question_terms.cache_info().hits == 2
+    assert matcher.result_columns.cache_info().hits == 1
@@ -0,0 +1,77 @@
+import pytest
+
+from text2sql_runtime.sql import extract_sql, sql_block_closed
+
+
+def test_sql_fence_wins_and_is_put_on_one_line():
+    extraction = extract_sql(
+        "Ответ:\n```sql\nSELECT name\nFROM users\nWHERE id = 5;\n```\nГотово."
+    )
+    assert extraction.sql == "SELECT name FROM users WHERE id = 5;"
+    assert extraction.reasoning == "Ответ:\n\nГотово."
+
+
+def test_sql_label_wins_over_fence_without_language():
+    extraction = extract_sql("```\nSELECT 1\n```\n3. SQL: SELECT 2")
+    assert extraction.sql == "SELECT 2"
+    assert "SELECT 1" in extraction.reasoning
+
+
+def test_fence_without_language_is_used_alone():
+    assert extract_sql("Запрос:\n```\nSELECT 1\n```").sql == "SELECT 1"
+
+
+def test_numbered_answer_label():
+    extraction = extract_sql("1. Таблицы: users\n3. SQL: SELECT name FROM users WHERE id = 5")
+    assert extraction.sql == "SELECT name FROM users WHERE id = 5"
+    assert extraction.reasoning == "1. Таблицы: users\n3. SQL:"
+
+
+def test_bare_statement_ends_at_blank_line():
+    extraction = extract_sql("Нужна таблица users.\nSELECT name\nFROM users\n\nПояснение.")
+    assert extraction.sql == "SELECT name FROM users"
+    assert extraction.reasoning == "Нужна таблица users.\n\n\nПояснение."
+
+
+def test_drafts_inside_think_are_ignored():
+    extraction = extract_sql(
+        "<think>draft\n```sql\nSELECT bad\n```\n</think>```sql\nSELECT 2\n```"
+    )
+    assert extraction.sql == "SELECT 2"
+    assert extraction.reasoning == "draft\n```sql\nSELECT bad\n```"
+
+
+def test_unclosed_think_ends_where_the_answer_starts():
+    extraction = extract_sql("<think>думаю про таблицы\nSELECT name FROM users")
+    assert extraction.sql == "SELECT name FROM users"
+    assert extraction.reasoning == "думаю про таблицы"
+
+
+@pytest.mark.parametrize(
+    "response, sql",
+    [
+        ("SELECT '--not a comment' AS a -- real comment\nFROM t", "SELECT '--not a comment' AS a FROM t"),
+        ("SELECT a /* why */ FROM t", "SELECT a FROM t"),
+        ("SELECT 'a  b' FROM t", "SELECT 'a  b' FROM t"),
+        ('SELECT "odd -- name" FROM t', 'SELECT "odd -- name" FROM t'),
+        ("SELECT a\\nFROM t", "SELECT a FROM t"),
+    ],
+)
+def test_comments_and_whitespace_outside_literals(response, sql):
+    assert extract_sql(response).sql == sql
+
+
+def test_everything_after_the_first_semicolon_is_dropped():
+    assert extract_sql("SELECT 'a;b' FROM t; DROP TABLE t").sql == "SELECT 'a;b' FROM t;"
+
+
+def test_response_without_statement_is_the_query():
+    assert extract_sql("  нет запроса  ") == extract_sql("нет запроса")
+    assert extract_sql("нет запроса").sql == "нет запроса"
+
+
+def test_sql_block_closed():
+    assert sql_block_closed("x```sql\nSELECT 1\n```")
+    assert not sql_block_closed("x```sql\nSELECT 1")
+    assert not sql_block_closed("<think>```sql\nSELECT 1\n```")
+    assert sql_block_closed("<think>a</think>```sql\nSELECT 1\n```")
@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+
+from text2sql_runtime.schema import SchemaGraph, SchemaGraphCache
+
+
+def table(name: str, *columns: str) -> SimpleNamespace:
+    """A table whose columns are given as "name" or "name->table.column" """
+    cols_info = []
+    for column in columns:
+        column_name, _, foreign_key = column.partition("->")
+        cols_info.append(SimpleNamespace(name=column_name, foreign_key=foreign_key or None))
+    return SimpleNamespace(name=name, cols_info=cols_info)
+
+
+def shop() -> list[SimpleNamespace]:
+    return [
+        table("regions", "id", "name"),
+        table("users", "id", "region_id->regions.id", "manager_id->users.id"),
+        table("orders", "id", "user_id->users.id", "referrer_id->users.id", "shop_id->shops.id"),
+        table("products", "id"),
+        table("order_items", "order_id->orders.id", "product_id->products.id"),
+        table("audit", "id"),
+    ]
+
+
+def test_joins_in_declaration_order():
+    assert SchemaGraph(shop()).joins == [
+        ("users", "region_id", "regions", "id"),
+        ("users", "manager_id", "users", "id"),
+        ("orders", "user_id", "users", "id"),
+        ("orders", "referrer_id", "users", "id"),
+        ("orders", "shop_id", "shops", "id"),
+        ("order_items", "order_id", "orders", "id"),
+        ("order_items", "product_id", "products", "id"),
+    ]
+
+
+def test_columns_are_lowercase():
+    graph = SchemaGraph([table("Users", "ID", "Name")])
+    assert graph.columns == {"users": frozenset({"id", "name"})}
+
+
+def test_shortest_path():
+    graph = SchemaGraph(shop())
+    assert graph.path("orders", "regions") == (
+        ("orders", "user_id", "users", "id"),
+        ("users", "region_id", "regions", "id"),
+    )
+    assert graph.path("regions", "regions") == ()
+    assert graph.path("regions", "audit") is None
+    # a foreign key to a table the schema does not describe is no edge
+    assert graph.path("orders", "shops") is None
+
+
+def test_join_chain_lists_every_key_between_the_tables_of_the_paths():
+    # users is on the path from orders to regions; its self reference and the second
+    # key from orders to users are returned as well
+    assert SchemaGraph(shop()).join_chain(["orders", "regions"]) == [
+        ("users", "region_id", "regions", "id"),
+        ("users", "manager_id", "users", "id"),
+        ("orders", "user_id", "users", "id"),
+        ("orders", "referrer_id", "users", "id"),
+    ]
+
+
+def test_join_chain_connects_each_table_to_those_before_it():
+    assert SchemaGraph(shop()).join_chain(["products", "orders"]) == [
+        ("order_items", "order_id", "orders", "id"),
+        ("order_items", "product_id", "products", "id"),
+    ]
+
+
+def test_join_chain_of_one_table_is_its_self_references():
+    graph = SchemaGraph(shop())
+    assert graph.join_chain(["users"]) == [("users", "manager_id", "users", "id")]
+    assert graph.join_chain(["regions"]) == []
+
+
+def test_join_chain_skips_unconnected_tables():
+    assert SchemaGraph(shop()).join_chain(["audit", "regions", "users"]) == [
+        ("users", "region_id", "regions", "id"),
+        ("users", "manager_id", "users", "id"),
+    ]
+
+
+def test_cache_reuses_the_graph_of_the_same_schema():
+    cache = SchemaGraphCache(max_size=1)
+    graph = cache.get(shop())
+    assert cache.get(shop()) is graph
+    cache.get([table("audit", "id")])
+    assert cache.get(shop()) is not graph
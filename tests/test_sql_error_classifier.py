@@ -0,0 +1,100 @@
+import pytest
+
+from conftest import load_experiment
+
+experiment = load_experiment("20250722_004521_lightweight_metadata_feedback")
+DialectPack = experiment.DialectPack
+SqlError = experiment.SqlError
+SqlErrorClassifier = experiment.SqlErrorClassifier
+
+DUCKDB_COLUMN = (
+    'Binder Error: Referenced column "salary" not found in FROM clause!\n'
+    'Candidate bindings: "vacancies.salary_from"\n'
+    "LINE 1: SELECT salary FROM vacancies\n"
+    "               ^"
+)
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        (DUCKDB_COLUMN, SqlError("column", "salary", (1, 8), "duckdb")),
+        ("Catalog Error: Table with name vacancy does not exist!", SqlError("table", "vacancy", None, "duckdb")),
+        ('Parser Error: syntax error at or near "FORM"', SqlError("syntax", "FORM", None, "duckdb")),
+        ('Ambiguous reference to column name "id"', SqlError("ambiguous", "id", None, "duckdb")),
+        ("Out of Memory Error: failed to allocate", SqlError("environment", None, None, "duckdb")),
+        (
+            '(psycopg2.errors.UndefinedColumn) column "salry" does not exist\n'
+            "LINE 1: SELECT salry FROM t\n"
+            "               ^",
+            SqlError("column", "salry", (1, 8), "postgres"),
+        ),
+        ("(psycopg2.errors.UndefinedColumn) column v.salry does not exist", SqlError("column", "v.salry", None, "postgres")),
+        ("sqlite3.OperationalError: no such column: salry", SqlError("column", "salry", None, "sqlite")),
+        ("sqlite3.OperationalError: ambiguous column name: id", SqlError("ambiguous", "id", None, "sqlite")),
+        ("no such table: vacancy", SqlError("table", "vacancy", None, "generic")),
+        ("something else entirely", SqlError("unknown")),
+    ],
+)
+def test_classify(error, expected):
+    assert SqlErrorClassifier().classify(error) == expected
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        ("Error: column salry does not exist", SqlError("column", "salry", None, "generic", True)),
+        ("ERROR: Missing FROM keyword", SqlError("structure", "FROM", None, "generic", True)),
+        ("Error: Invalid column reference", SqlError("reference", "column", None, "generic", True)),
+    ],
+)
+def test_generic_structural_errors_need_select_from(error, expected):
+    classifier = SqlErrorClassifier()
+    assert classifier.classify(error) == expected
+    assert classifier.should_regenerate(error, "SELECT a FROM t")
+    assert not classifier.should_regenerate(error, "WITH x AS (SELECT 1)")
+
+
+@pytest.mark.parametrize(
+    "error, regenerate",
+    [
+        (DUCKDB_COLUMN, True),
+        ('Parser Error: syntax error at or near "FORM"', True),
+        ('column "city" must appear in the GROUP BY clause', True),
+        ('Ambiguous reference to column name "id"', False),
+        ("Conversion Error: Could not convert string 'a' to INT32", False),
+        ("Out of Memory Error: failed to allocate", False),
+        ("something else entirely", False),
+    ],
+)
+def test_should_regenerate(error, regenerate):
+    assert SqlErrorClassifier().should_regenerate(error, "SELECT 1") is regenerate
+
+
+def test_marked_pack_is_tried_first():
+    packs = (
+        DialectPack("loose", None, (("table", r"does not exist"),)),
+        DialectPack("engine", r"EngineError", (("column", r"column (?P<id>\w+) does not exist"),)),
+    )
+    classifier = SqlErrorClassifier(packs)
+    assert classifier.classify("EngineError: column a does not exist") == SqlError(
+        "column", "a", None, "engine"
+    )
+    assert classifier.classify("column a does not exist") == SqlError(
+        "table", None, None, "loose"
+    )
+
+
+def test_patterns_are_case_sensitive_unless_the_pack_ignores_case():
+    patterns = (("syntax", r"Parser Error"),)
+    strict = SqlErrorClassifier((DialectPack("strict", None, patterns),))
+    loose = SqlErrorClassifier((DialectPack("loose", None, patterns, ignore_case=True),))
+    assert strict.classify("parser error").kind == "unknown"
+    assert loose.classify("parser error").kind == "syntax"
+
+
+def test_classification_is_memoized():
+    classifier = SqlErrorClassifier()
+    classifier.should_regenerate(DUCKDB_COLUMN, "SELECT 1")
+    classifier.should_regenerate(DUCKDB_COLUMN, "SELECT 2")
+    assert classifier.classify.cache_info().hits == 1
@@ -0,0 +1,91 @@
+import pytest
+
+from text2sql_runtime.sql import SqlStaticValidator, StaticIssue, StaticValidationError
+
+pytest.importorskip("sqlglot")
+
+DDL = (
+    "CREATE TABLE vacancies (id INT, title TEXT, city TEXT, salary_from INT, salary_to INT, company_id INT)",
+    "CREATE TABLE companies (id INT, name TEXT, city TEXT)",
+)
+SCHEMA = {
+    "vacancies": frozenset({"id", "title", "city", "salary_from", "salary_to", "company_id"}),
+    "companies": frozenset({"id", "name", "city"}),
+}
+
+REJECTED = [
+    ("SELECT salary FROM vacancies", [("column", "salary")]),
+    ("SELECT title FROM vacancy", [("table", "vacancy")]),
+    ("SELECT v.salary FROM vacancies v", [("column", "salary")]),
+    ("SELECT x.title FROM vacancies v", [("table", "x")]),
+    ("SELECT city FROM vacancies v JOIN companies c ON v.company_id = c.id", [("ambiguous", "city")]),
+    ("SELECT city, COUNT(*) FROM vacancies", [("group_by", "city")]),
+    ("SELECT city, title, COUNT(*) FROM vacancies GROUP BY city", [("group_by", "title")]),
+    ("SELECT (salary_from  salary_to) FROM vacancies", [("syntax", "salary_to")]),
+    ("SELECT b FROM (SELECT title AS a FROM vacancies) t", [("column", "b")]),
+    ("SELECT title FROM vacancies WHERE id IN (SELECT id FROM companies WHERE nam = 'x')", [("column", "nam")]),
+]
+
+ACCEPTED = [
+    "SELECT title FROM vacancies",
+    "SELECT city FROM vacancies JOIN companies USING (city)",
+    "SELECT city AS c, COUNT(*) FROM vacancies GROUP BY c",
+    "SELECT city, COUNT(*) FROM vacancies GROUP BY 1",
+    "SELECT title FROM vacancies v WHERE EXISTS (SELECT 1 FROM companies c WHERE c.id = v.company_id)",
+    "SELECT rowid FROM vacancies",
+    "SELECT a FROM (SELECT title AS a FROM vacancies) t",
+    "SELECT title, salary_from * 2 AS double FROM vacancies ORDER BY double",
+]
+
+# left to the database: a table function, an unknown function and what sqlglot cannot parse
+UNDECIDED = [
+    "SELECT * FROM read_csv('x.csv')",
+    "SELECT my_func(title) FROM vacancies",
+    "SELEC broken",
+]
+
+
+@pytest.mark.parametrize("sql, issues", REJECTED)
+def test_rejected(sql, issues):
+    found = SqlStaticValidator().validate(sql, SCHEMA)
+    assert [(issue.kind, issue.identifier) for issue in found] == issues
+
+
+@pytest.mark.parametrize("sql", ACCEPTED + UNDECIDED)
+def test_accepted(sql):
+    assert SqlStaticValidator().validate(sql, SCHEMA) == []
+
+
+def test_without_schema_nothing_is_checked():
+    assert SqlStaticValidator().validate("SELECT salary FROM vacancies", {}) == []
+
+
+def test_candidate_bindings():
+    (issue,) = SqlStaticValidator().validate("SELECT salary FROM vacancies", SCHEMA)
+    assert issue.message.endswith('\nCandidate bindings: "salary_to", "salary_from"')
+
+
+def test_parsed_queries_are_memoized():
+    validator = SqlStaticValidator()
+    for _ in range(3):
+        validator.validate("SELECT salary FROM vacancies", SCHEMA)
+    assert validator._scopes.cache_info().hits == 2
+
+
+def test_error_lists_every_issue():
+    issues = [StaticIssue("column", "a", "first"), StaticIssue("table", "t", "second")]
+    error = StaticValidationError(issues)
+    assert str(error) == "first\nsecond"
+    assert error.issues == issues
+
+
+@pytest.mark.parametrize("sql, issues", REJECTED)
+def test_duckdb_rejects_with_the_same_message(sql, issues):
+    duckdb = pytest.importorskip("duckdb")
+    connection = duckdb.connect()
+    for statement in DDL:
+        connection.execute(statement)
+    (issue,) = SqlStaticValidator().validate(sql, SCHEMA)
+    with pytest.raises(duckdb.Error) as error:
+        connection.execute(sql)
+    assert str(error.value).startswith(issue.message.split("\n")[0])
@@ -0,0 +1 @@
+"""Code shared by the experiment.py files of the idea folders."""
@@ -0,0 +1,281 @@
+"""Gold question/SQL examples: retrieval by similarity and diverse selection."""
+
+import json
+import os
+import re
+import threading
+import zlib
+from functools import lru_cache
+
+import numpy as np
+
+from src.text2sql_bench.vector_db import GoldRecord
+from text2sql_runtime.schema import IDENTIFIER_WORD
+
+
+class HashingEmbedder:
+    """Embeds texts as signed feature hashes of their word stems and character trigrams.
+
+    Deterministic and dependency-free, it captures lexical overlap only. Any callable
+    mapping a list of texts to an (n, dim) array, such as the `encode` method of a
+    sentence-transformers model, can be given to GoldIndex instead.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def __call__(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = IDENTIFIER_WORD.findall(str(text).lower())
+            features = [f"w:{word[:5]}" for word in words]
+            features += [f"t:{word[i : i + 3]}" for word in words for i in range(len(word) - 2)]
+            for feature in features:
+                h = zlib.crc32(feature.encode("utf-8"))
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return vectors
+
+
+class GoldIndex:
+    """In-process IVF index for few-shot retrieval of gold records by their question.
+
+    Spherical k-means splits the unit-length embeddings into inverted lists, and a
+    query scans only the `nprobe` lists with the closest centroids, so `nprobe` trades
+    recall for latency (`bench.py --only gold_index` measures both against exact
+    search). Vectors are stored list by list, so every probe reads one contiguous
+    slice of the array that `load()` memory-maps.
+
+    `add()` inserts records incrementally: they are scanned exhaustively until they
+    outgrow `rebuild_ratio` of the indexed ones, which re-trains the lists. `select()`
+    makes the index usable as the wrapper's `gold_selector`.
+    """
+
+    def __init__(
+        self,
+        embed=None,
+        lists: int | None = None,
+        nprobe: int = 16,
+        rebuild_ratio: float = 0.5,
+    ):
+        self.embed = embed or HashingEmbedder()
+        self.lists = lists
+        self.nprobe = nprobe
+        self.rebuild_ratio = rebuild_ratio
+        self._centroids: np.ndarray | None = None
+        self._vectors: np.ndarray | None = None
+        self._offsets: np.ndarray | None = None
+        self._records: list[GoldRecord] = []
+        self._tail_vectors: list[np.ndarray] = []
+        self._tail_records: list[GoldRecord] = []
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._records) + len(self._tail_records)
+
+    @property
+    def list_count(self) -> int:
+        return 0 if self._centroids is None else len(self._centroids)
+
+    @property
+    def records(self) -> list[GoldRecord]:
+        """Records in index order; search results are positions in this list"""
+        with self._lock:
+            return self._records + self._tail_records
+
+    def embed_questions(self, questions: list[str]) -> np.ndarray:
+        vectors = np.asarray(self.embed(list(questions)), dtype=np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def add(self, records: list[GoldRecord]):
+        if not records:
+            return
+        vectors = self.embed_questions([record.question for record in records])
+        with self._lock:
+            self._tail_vectors.append(vectors)
+            self._tail_records.extend(records)
+            if len(self._tail_records) > self.rebuild_ratio * len(self._records):
+                self._rebuild()
+
+    def _rebuild(self):
+        parts = [self._vectors] if self._vectors is not None else []
+        vectors = np.concatenate(parts + self._tail_vectors)
+        records = self._records + self._tail_records
+        lists = min(self.lists or max(1, int(np.sqrt(len(vectors)))), len(vectors))
+        centroids = self._kmeans(vectors, lists)
+        assignment = self._assign(vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        self._centroids = centroids
+        self._vectors = np.ascontiguousarray(vectors[order])
+        self._offsets = np.searchsorted(assignment[order], np.arange(len(centroids) + 1))
+        self._records = [records[i] for i in order]
+        self._tail_vectors, self._tail_records = [], []
+
+    @staticmethod
+    def _assign(vectors: np.ndarray, centroids: np.ndarray, batch: int = 4096) -> np.ndarray:
+        return np.concatenate(
+            [
+                np.argmax(vectors[i : i + batch] @ centroids.T, axis=1)
+                for i in range(0, len(vectors), batch)
+            ]
+        )
+
+    @classmethod
+    def _kmeans(
+        cls, vectors: np.ndarray, k: int, iterations: int = 10, sample: int = 256
+    ) -> np.ndarray:
+        """Spherical k-means, trained on at most `sample` vectors per centroid"""
+        rnd = np.random.default_rng(0)
+        if len(vectors) > sample * k:
+            vectors = vectors[rnd.choice(len(vectors), sample * k, replace=False)]
+        centroids = vectors[rnd.choice(len(vectors), k, replace=False)]
+        for _ in range(iterations):
+            assignment = cls._assign(vectors, centroids)
+            sums = np.zeros_like(centroids)
+            for i in range(0, len(vectors), 4096):
+                # a one-hot product sums each cluster far faster than np.add.at
+                chunk = assignment[i : i + 4096]
+                one_hot = np.zeros((len(chunk), k), dtype=np.float32)
+                one_hot[np.arange(len(chunk)), chunk] = 1.0
+                sums += one_hot.T @ vectors[i : i + 4096]
+            empty = np.bincount(assignment, minlength=k) == 0
+            sums[empty] = vectors[rnd.choice(len(vectors), int(empty.sum()))]
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        return centroids.astype(np.float32)
+
+    def search(
+        self, queries: np.ndarray, k: int, nprobe: int | None = None
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        """(positions, scores) of the `k` best records for each query vector, best first"""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        with self._lock:
+            centroids, vectors, offsets = self._centroids, self._vectors, self._offsets
+            tail = np.concatenate(self._tail_vectors) if self._tail_vectors else None
+            base = len(self._records)
+        if centroids is None:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))] * len(queries)
+        nprobe = min(nprobe or self.nprobe, len(centroids))
+        probes = np.argpartition(-(queries @ centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        results = []
+        for query, lists in zip(queries, probes):
+            positions = [np.arange(offsets[i], offsets[i + 1]) for i in lists]
+            scores = [vectors[offsets[i] : offsets[i + 1]] @ query for i in lists]
+            if tail is not None:
+                positions.append(np.arange(base, base + len(tail)))
+                scores.append(tail @ query)
+            positions, scores = np.concatenate(positions), np.concatenate(scores)
+            if len(scores) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+            else:
+                top = np.arange(len(scores))
+            top = top[np.argsort(-scores[top], kind="stable")]
+            results.append((positions[top], scores[top]))
+        return results
+
+    def select(self, questions: list[str], k: int) -> list[list[GoldRecord]]:
+        """The `k` gold records closest to each question, in one batch"""
+        if not questions or not len(self):
+            return [[] for _ in questions]
+        with self._lock:
+            records = self.records
+            results = self.search(self.embed_questions(questions), k)
+        return [[records[i] for i in positions] for positions, _ in results]
+
+    def save(self, directory: str):
+        """Write the index; files are replaced atomically, so a mapped index stays valid"""
+        with self._lock:
+            if self._tail_records:
+                self._rebuild()
+            if self._centroids is None:
+                raise ValueError("The gold index is empty")
+            os.makedirs(directory, exist_ok=True)
+            for name, array in (
+                ("centroids", self._centroids),
+                ("vectors", self._vectors),
+                ("offsets", self._offsets),
+            ):
+                path = os.path.join(directory, f"{name}.npy")
+                with open(f"{path}.tmp", "wb") as f:
+                    np.save(f, array)
+                os.replace(f"{path}.tmp", path)
+            path = os.path.join(directory, "records.jsonl")
+            with open(f"{path}.tmp", "w") as f:
+                for record in self._records:
+                    record = {"question": record.question, "sql": record.sql}
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, directory: str, embed=None, nprobe: int = 16) -> "GoldIndex":
+        """Index written by `save()`, with the vectors memory-mapped instead of read"""
+        index = cls(embed, nprobe=nprobe)
+        index._centroids = np.load(os.path.join(directory, "centroids.npy"))
+        index._vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        index._offsets = np.load(os.path.join(directory, "offsets.npy"))
+        index._records = cls.read_records(os.path.join(directory, "records.jsonl"))
+        return index
+
+    @staticmethod
+    def read_records(path: str) -> list[GoldRecord]:
+        """Gold records from JSON lines with `question` and `sql` keys"""
+        with open(path) as f:
+            return [
+                GoldRecord(question=record["question"], sql=record["sql"])
+                for record in map(json.loads, f)
+            ]
+
+
+_SQL_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LITERAL_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+
+
+@lru_cache(maxsize=16384)
+def _sql_skeleton(sql: str) -> str:
+    """SQL with literals replaced by ?, lists of them collapsed and whitespace normalized"""
+    skeleton = _LITERAL_LIST.sub("?", _SQL_LITERAL.sub("?", sql.lower()))
+    return " ".join(skeleton.split())
+
+
+class GoldDiversifier:
+    """Picks few-shot gold records that are relevant without repeating each other.
+
+    Records whose SQL shares a skeleton (the SQL with its literals stripped) form a
+    cluster, and at most `per_skeleton` records of a cluster are kept. The rest are
+    picked by maximal marginal relevance: the retrieval rank, against the token
+    overlap with the skeletons already picked weighted by `diversity`, for as long as
+    the rendered records fit in `max_tokens`. The most relevant record is always kept.
+    """
+
+    def __init__(
+        self, max_tokens: int | None = None, diversity: float = 0.3, per_skeleton: int = 1
+    ):
+        self.max_tokens = max_tokens
+        self.diversity = diversity
+        self.per_skeleton = per_skeleton
+
+    def select(self, gold_recs: list[GoldRecord], count_tokens) -> list[GoldRecord]:
+        """Subset of `gold_recs`, in their order; `count_tokens` prices a list of records"""
+        skeletons = [_sql_skeleton(record.sql) for record in gold_recs]
+        terms = [frozenset(skeleton.split()) for skeleton in skeletons]
+        clusters: dict[str, int] = {}
+        picked: list[int] = []
+        remaining = list(range(len(gold_recs)))
+
+        def marginal_relevance(i: int) -> float:
+            overlap = max(
+                (len(terms[i] & terms[j]) / (len(terms[i] | terms[j]) or 1) for j in picked),
+                default=0.0,
+            )
+            return (1 - self.diversity) * (1 - i / len(gold_recs)) - self.diversity * overlap
+
+        while remaining:
+            best = max(remaining, key=marginal_relevance)
+            remaining.remove(best)
+            if clusters.get(skeletons[best], 0) >= self.per_skeleton:
+                continue
+            if picked and self.max_tokens is not None:
+                chosen = [gold_recs[i] for i in sorted(picked + [best])]
+                if count_tokens(chosen) > self.max_tokens:
+                    continue
+            clusters[skeletons[best]] = clusters.get(skeletons[best], 0) + 1
+            picked.append(best)
+        return [gold_recs[i] for i in sorted(picked)]
@@ -0,0 +1,368 @@
+"""Chat API plumbing shared by all wrappers: clients, cache, rate limits, usage."""
+
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+import httpx
+from langchain_core.messages import BaseMessage
+from langchain_gigachat import GigaChat
+
+from text2sql_runtime.tracing import question_trace
+
+
+class LLMResponseCache:
+    """Persistent SQLite store of chat completions.
+
+    Entries are addressed by a hash of the model name, the sampling temperature, the
+    client settings such as the endpoint and the full message list, so a re-run only
+    pays for prompts that actually changed. The
+    least recently used entries are evicted above `max_entries`, and entries older than
+    `max_age` seconds are treated as missing. The number of entries is counted once and
+    then kept up to date by the writes, so a cache file serves one process at a time.
+    """
+
+    def __init__(self, path: str, max_entries: int = 100_000, max_age: float | None = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, content TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)"
+        )
+        self._conn.commit()
+        (self._count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+
+    @staticmethod
+    def key(
+        model: str,
+        temperature: float | None,
+        messages: list[BaseMessage],
+        settings: dict | None = None,
+    ) -> str:
+        payload = json.dumps(
+            {
+                "model": model,
+                "temperature": temperature,
+                "settings": settings or {},
+                "messages": [[message.type, message.content] for message in messages],
+            },
+            ensure_ascii=False,
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.max_age is not None and now - row[1] > self.max_age:
+                self._count -= self._conn.execute(
+                    "DELETE FROM responses WHERE key = ?", (key,)
+                ).rowcount
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, content: str):
+        now = time.time()
+        with self._lock:
+            inserted = self._conn.execute(
+                "INSERT OR IGNORE INTO responses VALUES (?, ?, ?, ?)",
+                (key, content, now, now),
+            ).rowcount
+            if inserted:
+                self._count += inserted
+            else:
+                self._conn.execute(
+                    "UPDATE responses SET content = ?, created_at = ?, accessed_at = ? "
+                    "WHERE key = ?",
+                    (content, now, now, key),
+                )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        if self.max_age is not None:
+            self._count -= self._conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (now - self.max_age,)
+            ).rowcount
+        if self._count > self.max_entries:
+            self._count -= self._conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+                (self._count - self.max_entries,),
+            ).rowcount
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class ChatModelPool:
+    """Process-wide registry of chat clients keyed by their settings.
+
+    The HTTP client inside GigaChat keeps connections alive, but only for the event
+    loop it was first used on, so every pooled client comes with its own loop, run
+    forever by a daemon thread that the synchronous entry points submit work to.
+    """
+
+    def __init__(self):
+        self._models: dict[tuple, tuple[GigaChat, asyncio.AbstractEventLoop]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, **kwargs) -> tuple[GigaChat, asyncio.AbstractEventLoop]:
+        key = tuple(sorted((name, repr(value)) for name, value in kwargs.items()))
+        with self._lock:
+            if key not in self._models:
+                CONNECTION_METRICS.install()
+                loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=loop.run_forever, name="chat-model-loop", daemon=True
+                ).start()
+                self._models[key] = (GigaChat(**kwargs), loop)
+            return self._models[key]
+
+
+class ConnectionMetrics(logging.Handler):
+    """Counts the TCP connects and TLS handshakes of the chat clients and their time.
+
+    httpcore traces connection setup on the "httpcore.connection" logger at DEBUG
+    level; the records are emitted inside the task making the request, so the cost is
+    also charged to the question evaluated there. The records are counted by a filter
+    on that logger, which passes on only those the logger let through before, so its
+    handlers and propagation see what they saw without the metrics.
+    """
+
+    LOGGER = "httpcore.connection"
+    EVENTS = ("connect_tcp", "start_tls")
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.counts = {event: 0 for event in self.EVENTS}
+        self.seconds = 0.0
+        self._started: dict[tuple[int, int], float] = {}
+        self._installed = False
+        self._level = logging.NOTSET
+        self._threshold = logging.NOTSET
+
+    def install(self):
+        if self._installed:
+            return
+        self._installed = True
+        logger = logging.getLogger(self.LOGGER)
+        self._level = logger.level
+        self._threshold = logger.getEffectiveLevel()
+        logger.setLevel(logging.DEBUG)
+        logger.addFilter(self._observe)
+
+    def uninstall(self):
+        if not self._installed:
+            return
+        self._installed = False
+        logger = logging.getLogger(self.LOGGER)
+        logger.removeFilter(self._observe)
+        logger.setLevel(self._level)
+
+    def _observe(self, record: logging.LogRecord) -> bool:
+        self.handle(record)
+        return record.levelno >= self._threshold
+
+    def emit(self, record: logging.LogRecord):
+        event, _, phase = record.getMessage().partition(" ")[0].rpartition(".")
+        if event not in self.EVENTS:
+            return
+        try:
+            task = id(asyncio.current_task())
+        except RuntimeError:
+            task = 0
+        key = (record.thread, task)
+        now = time.perf_counter()
+        if phase == "started":
+            self._started[key] = now
+            return
+        started = self._started.pop(key, None)
+        if phase != "complete" or started is None:
+            return
+        with self.lock:
+            self.counts[event] += 1
+            self.seconds += now - started
+        trace = question_trace.get()
+        if trace is not None:
+            trace.connects += event == "connect_tcp"
+            trace.connect_seconds += now - started
+
+    def stats(self) -> dict:
+        return {**self.counts, "seconds": round(self.seconds, 3)}
+
+
+class RateLimiter:
+    """Client-side throttle for the chat API, shareable between wrappers.
+
+    Token buckets cap requests and prompt tokens per minute, and the number of
+    requests in flight follows AIMD: it grows by one per `limit` successful requests
+    and halves on every 429, settling near the highest rate the provider sustains.
+    State is guarded by a thread lock and waiting is done by polling, so the limiter
+    is not tied to one event loop.
+    """
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(
+        self,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        max_concurrency: int = 16,
+        min_concurrency: int = 1,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.throttled = 0
+        self.waited = 0.0
+        self._request_budget = requests_per_minute or 0.0
+        self._token_budget = tokens_per_minute or 0.0
+        self._refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        minutes = (now - self._refilled_at) / 60
+        self._refilled_at = now
+        if self.requests_per_minute:
+            self._request_budget = min(
+                self.requests_per_minute, self._request_budget + minutes * self.requests_per_minute
+            )
+        if self.tokens_per_minute:
+            self._token_budget = min(
+                self.tokens_per_minute, self._token_budget + minutes * self.tokens_per_minute
+            )
+
+    def _delay(self, tokens: int) -> float:
+        """Seconds until both buckets hold enough for the request, 0 if they do now."""
+        delay = 0.0
+        if self.requests_per_minute and self._request_budget < 1:
+            delay = max(delay, (1 - self._request_budget) / self.requests_per_minute * 60)
+        if self.tokens_per_minute:
+            # a prompt larger than the whole bucket waits for a full bucket
+            needed = min(tokens, self.tokens_per_minute)
+            if self._token_budget < needed:
+                delay = max(delay, (needed - self._token_budget) / self.tokens_per_minute * 60)
+        return delay
+
+    async def acquire(self, tokens: int = 0):
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                self._refill()
+                delay = self._delay(tokens)
+                if not delay and self.in_flight < int(self.limit):
+                    if self.requests_per_minute:
+                        self._request_budget -= 1
+                    if self.tokens_per_minute:
+                        self._token_budget -= min(tokens, self.tokens_per_minute)
+                    self.in_flight += 1
+                    self.waited += time.monotonic() - started
+                    return
+            await asyncio.sleep(max(delay, self.POLL_INTERVAL))
+
+    def release(self, throttled: bool = False):
+        with self._lock:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                self.limit = max(float(self.min_concurrency), self.limit / 2)
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "limit": round(self.limit, 2),
+                "throttled": self.throttled,
+                "waited": round(self.waited, 3),
+            }
+
+
+def response_status(error: Exception) -> int | None:
+    status = getattr(error, "status_code", None)
+    if status is None and isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+    return status
+
+
+def retry_after(error: Exception) -> float:
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class TokenUsage:
+    """Tokens billed by the chat API, including prompt tokens served from its cache.
+
+    Totals are kept for the process and also charged to the question being evaluated.
+    """
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, result: BaseMessage):
+        usage = getattr(result, "usage_metadata", None) or {}
+        prompt = usage.get("input_tokens") or 0
+        cached = (usage.get("input_token_details") or {}).get("cache_read") or 0
+        completion = usage.get("output_tokens") or 0
+        with self._lock:
+            self.prompt_tokens += prompt
+            self.cached_prompt_tokens += cached
+            self.completion_tokens += completion
+        trace = question_trace.get()
+        if trace is not None:
+            trace.prompt_tokens += prompt
+            trace.cached_prompt_tokens += cached
+        logging.debug(f"Prompt tokens: {prompt}, {cached} of them from the provider cache")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "prompt_tokens": self.prompt_tokens,
+                "cached_prompt_tokens": self.cached_prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+            }
+
+
+CHAT_MODELS = ChatModelPool()
+CONNECTION_METRICS = ConnectionMetrics()
+TOKEN_USAGE = TokenUsage()
@@ -0,0 +1,154 @@
+"""Sections of the prompts, rendered once per question and kept within a budget."""
+
+import logging
+from functools import cached_property
+from typing import TYPE_CHECKING
+
+from langchain_core.messages import BaseMessage
+from src.text2sql_bench.core.model import ContextData
+from src.text2sql_bench.vector_db import GoldRecord
+
+try:
+    import tiktoken
+except ImportError:  # token counts are estimated from the length instead
+    tiktoken = None
+
+if TYPE_CHECKING:
+    from text2sql_runtime.wrapper import ScientistWrapper
+
+
+PROMPT_LAYOUTS = ("template", "prefix_cache")
+# sections rendered from the database alone, the same for every question
+SHARED_SECTIONS = ("ddl", "stats")
+
+
+class PromptFragments:
+    """Rendered prompt pieces of one question, each built on first use and then reused.
+
+    The prompt builders and the hint filter of a question share one instance, so the
+    schema, gold examples and hints are rendered once however many retries it takes.
+    `hints` reads the context on first access, which happens after hint filtering.
+    `SECTIONS` are the pieces PromptBudget counts one by one.
+    """
+
+    SECTIONS = ("hints", "ddl", "gold", "stats")
+
+    def __init__(self, wrapper: "ScientistWrapper", context: ContextData):
+        self._wrapper = wrapper
+        self._context = context
+        # set by `trim()` when the prompt is over the token budget
+        self.max_gold: int | None = None
+        self.max_samples: int | None = None
+        # cleared by `widen()` once a retry needs the full schema
+        self.prune_schema = wrapper.schema_linker is not None
+
+    def widen(self):
+        """Render the full schema from now on; a failed attempt may lack a pruned column"""
+        if self.prune_schema:
+            self.prune_schema = False
+            self.__dict__.pop("stats", None)
+
+    def trim(self) -> bool:
+        """Drop the least valuable piece of the prompt, False once there is nothing left.
+
+        Gold examples go first, least similar first, down to the best one; then the
+        sample values in the schema, 3, 1 and none per column; then the last example.
+        Hints and the schema itself are never dropped.
+        """
+        gold_count = len(self.gold_recs)
+        max_gold = gold_count if self.max_gold is None else min(self.max_gold, gold_count)
+        if max_gold > 1:
+            self.max_gold = max_gold - 1
+            self.__dict__.pop("gold", None)
+        elif self.max_samples != 0 and self._context.tables_info:
+            self.max_samples = 3 if self.max_samples is None else self.max_samples // 2
+            self.__dict__.pop("stats", None)
+        elif max_gold > 0:
+            self.max_gold = 0
+            self.__dict__.pop("gold", None)
+        else:
+            return False
+        return True
+
+    @cached_property
+    def hints(self) -> str:
+        hints = self._context.hints
+        return self._wrapper._hints_to_str(hints) if hints else ""
+
+    @cached_property
+    def ddl(self) -> str:
+        ddl = self._context.ddl
+        return self._wrapper._ddl_to_str(ddl) if ddl else ""
+
+    @cached_property
+    def gold_recs(self) -> list[GoldRecord]:
+        gold_recs = self._context.gold_recs or []
+        diversifier = self._wrapper.gold_diversifier
+        if diversifier is None or not gold_recs:
+            return gold_recs
+        budget = self._wrapper.prompt_budget
+        return diversifier.select(
+            gold_recs, lambda records: budget.count(self._wrapper._gold_to_str(records))
+        )
+
+    @cached_property
+    def gold(self) -> str:
+        gold_recs = self.gold_recs
+        if gold_recs and self.max_gold is not None:
+            gold_recs = gold_recs[: self.max_gold]
+        return self._wrapper._gold_to_str(gold_recs) if gold_recs else ""
+
+    @cached_property
+    def stats(self) -> str:
+        tables_info = self._context.tables_info
+        if not tables_info:
+            return ""
+        schema = tables_info
+        if self.prune_schema:
+            tables_info = self._wrapper.schema_linker.link(self._context.question, tables_info)
+        return self._wrapper._tables_info_to_str(
+            tables_info, max_samples=self.max_samples, schema=schema
+        )
+
+
+class PromptBudget:
+    """Counts the tokens of a prompt per section and checks it against `max_tokens`.
+
+    Tokens are counted with tiktoken when it is installed and otherwise estimated at
+    four characters per token; a budget only needs a count that is consistent from
+    one question to the next, not the exact one of every provider.
+    """
+
+    def __init__(self, max_tokens: int | None = None, encoding: str = "cl100k_base"):
+        self.max_tokens = max_tokens
+        self.encoding = encoding
+
+    @cached_property
+    def _encoding(self):
+        if tiktoken is None:
+            return None
+        try:
+            return tiktoken.get_encoding(self.encoding)
+        except Exception as e:  # the encoding is downloaded on first use
+            logging.warning(f"tiktoken encoding {self.encoding} unavailable, estimating: {e}")
+            return None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encoding is None:
+            return (len(text) + 3) // 4
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def breakdown(self, messages: list[BaseMessage], fragments: "PromptFragments") -> dict[str, int]:
+        """Tokens of every section, of the rest (instructions and question) and in total"""
+        total = sum(self.count(message.content) for message in messages)
+        sections = {name: self.count(getattr(fragments, name)) for name in fragments.SECTIONS}
+        return {**sections, "other": max(0, total - sum(sections.values())), "total": total}
+
+    def fits(self, messages: list[BaseMessage], fragments: "PromptFragments") -> bool:
+        if self.max_tokens is None and not logging.getLogger().isEnabledFor(logging.DEBUG):
+            return True
+        breakdown = self.breakdown(messages, fragments)
+        logging.debug(f"Prompt tokens by section: {breakdown}")
+        return self.max_tokens is None or breakdown["total"] <= self.max_tokens
@@ -0,0 +1,467 @@
+"""Benchmark runs with concurrent questions, checkpoints and reuse of earlier runs."""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from src.text2sql_bench.core.benchmark import BenchRunner
+from src.text2sql_bench.core.model import ContextData, RunConfig
+from src.text2sql_bench.dataset import load_datasets
+from src.text2sql_bench.db import DbConnection
+from src.text2sql_bench.model_wrappers.wrapper import ModelWrapper
+from text2sql_runtime.gold import GoldDiversifier, GoldIndex
+from text2sql_runtime.llm import CONNECTION_METRICS, TOKEN_USAGE, LLMResponseCache, RateLimiter
+from text2sql_runtime.prompts import PROMPT_LAYOUTS
+from text2sql_runtime.schema import SchemaLinker
+from text2sql_runtime.sql import VALIDATION_MODES, SqlStaticValidator
+from text2sql_runtime.tracing import Prediction
+from text2sql_runtime.wrapper import ScientistWrapper
+
+
+class RunJournal:
+    """Append-only journal of finished questions kept next to the run outputs.
+
+    Every prediction is written as one JSON line as soon as it is ready, so a run that
+    dies halfway can be resumed: questions journaled without an error are not asked
+    again and are replayed from the journal instead.
+    """
+
+    FILE_NAME = "journal.jsonl"
+
+    def __init__(self, out_dir: str):
+        self.path = os.path.join(out_dir, self.FILE_NAME)
+
+    def reset(self, records: list[dict] = ()):
+        """Start the journal over, keeping only `records`.
+
+        Rewriting on resume also drops a line cut short by a killed run, which would
+        otherwise swallow the next appended record.
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def load(self) -> dict[int, dict]:
+        """Successful records by question index; later records win."""
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line may be cut short if the run was killed mid-write
+                    continue
+                if record.get("error") is None:
+                    records[record["index"]] = record
+        return records
+
+    def append(self, index: int, question: str, prediction: Prediction):
+        record = {
+            "index": index,
+            "question": question,
+            "sql": prediction.sql,
+            "error": None if prediction.error is None else str(prediction.error),
+            "attempts": prediction.attempts,
+            "seconds": round(prediction.seconds, 3),
+            "connects": prediction.connects,
+            "connect_seconds": round(prediction.connect_seconds, 3),
+            "prompt_tokens": prediction.prompt_tokens,
+            "cached_prompt_tokens": prediction.cached_prompt_tokens,
+            "report": prediction.report,
+            "calls": [list(call) for call in prediction.calls],
+        }
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class _RecordingModel(ModelWrapper):
+    """Collects the contexts BenchRunner builds without asking the LLM for SQL."""
+
+    def __init__(self, model: ScientistWrapper):
+        self.model = model
+        self.requests: list[tuple[ContextData, DbConnection | None]] = []
+        # question -> enhanced question, so the replay pass does not ask the LLM again
+        self.enhanced: dict[str, str] = {}
+
+    def predict_sql(self, context: ContextData, db: DbConnection | None = None) -> str:
+        self.requests.append((context, db))
+        return "SELECT 1"
+
+    def enhance_question(self, question: str):
+        if question not in self.enhanced:
+            self.enhanced[question] = self.model.enhance_question(question)
+        return self.enhanced[question]
+
+    def name(self) -> str:
+        return self.model.name()
+
+
+class _ReplayModel(ModelWrapper):
+    """Hands precomputed predictions back to BenchRunner in the original order."""
+
+    def __init__(
+        self,
+        model: ScientistWrapper,
+        requests: list[tuple[ContextData, DbConnection | None]],
+        predictions: list[Prediction],
+        enhanced: dict[str, str] | None = None,
+    ):
+        self.model = model
+        self.questions = [context.question for context, _ in requests]
+        self.predictions = predictions
+        self.enhanced = enhanced or {}
+        self.position = 0
+
+    def predict_sql(self, context: ContextData, db: DbConnection | None = None) -> str:
+        position = self.position
+        self.position += 1
+        if position >= len(self.questions) or self.questions[position] != context.question:
+            logging.warning(
+                f"Question order changed between passes, predicting live: {context.question}"
+            )
+            return self.model.predict_sql(context, db)
+        prediction = self.predictions[position]
+        for line in prediction.report:
+            print(line)
+        if prediction.error is not None:
+            raise prediction.error
+        return prediction.sql
+
+    def enhance_question(self, question: str):
+        if question in self.enhanced:
+            return self.enhanced[question]
+        return self.model.enhance_question(question)
+
+    def name(self) -> str:
+        return self.model.name()
+
+
+class ConcurrentBenchRunner:
+    """BenchRunner drop-in that evaluates up to `concurrency` questions at once.
+
+    BenchRunner asks the wrapper for one prediction at a time, so the run is split in
+    two passes over the dataset: the first one only records the contexts, then all
+    predictions are computed concurrently, and the second pass replays them in the
+    dataset order so predictions.sql, result.log and the metrics come from BenchRunner
+    itself. With temperature 0 the output does not depend on `concurrency`. Questions
+    are enhanced once, in the first pass. With `concurrency` 1 and nothing to resume or
+    reuse there is nothing to gain from the passes, and a plain BenchRunner runs instead.
+
+    Finished questions are checkpointed to `RunJournal` in `output_path`; with `resume`
+    the journaled ones are replayed instead of predicted again, and the metrics are
+    recomputed over the whole dataset. With `reuse_from` pointing at a previous run,
+    prompts rendered identically to that run are answered from its journal, so after
+    a prompt change only the affected questions are asked again.
+    """
+
+    def __init__(
+        self,
+        report_manager,
+        bench_name: str,
+        dataset,
+        output_path: str,
+        concurrency: int = 1,
+        resume: bool = False,
+        reuse_from: str | None = None,
+    ):
+        self.report_manager = report_manager
+        self.bench_name = bench_name
+        self.dataset = dataset
+        self.output_path = output_path
+        self.concurrency = concurrency
+        self.resume = resume
+        self.reuse_from = reuse_from
+
+    def run(self, model: ScientistWrapper, prompt_name: str, config: RunConfig):
+        if self.concurrency == 1 and not self.resume and not self.reuse_from:
+            return BenchRunner(
+                report_manager=self.report_manager,
+                bench_name=self.bench_name,
+                dataset=self.dataset,
+                output_path=self.output_path,
+            ).run(model=model, prompt_name=prompt_name, config=config)
+
+        recorder = _RecordingModel(model)
+        recording_dir = tempfile.mkdtemp(prefix="record_")
+        try:
+            BenchRunner(
+                report_manager=None,
+                bench_name=self.bench_name,
+                dataset=self.dataset,
+                output_path=recording_dir,
+            ).run(model=recorder, prompt_name=prompt_name, config=config)
+        finally:
+            shutil.rmtree(recording_dir, ignore_errors=True)
+
+        predictions = self._predict(model, recorder.requests)
+
+        return BenchRunner(
+            report_manager=self.report_manager,
+            bench_name=self.bench_name,
+            dataset=self.dataset,
+            output_path=self.output_path,
+        ).run(
+            model=_ReplayModel(model, recorder.requests, predictions, recorder.enhanced),
+            prompt_name=prompt_name,
+            config=config,
+        )
+
+    def _predict(
+        self,
+        model: ScientistWrapper,
+        requests: list[tuple[ContextData, DbConnection | None]],
+    ) -> list[Prediction]:
+        # read before journal.reset, which wipes it when reusing the output directory
+        previous = {}
+        if self.reuse_from:
+            previous = {
+                record["question"]: [tuple(call) for call in record.get("calls", [])]
+                for record in RunJournal(self.reuse_from).load().values()
+            }
+
+        journal = RunJournal(self.output_path)
+        done = {}
+        if self.resume:
+            done = {
+                index: record
+                for index, record in journal.load().items()
+                if index < len(requests) and requests[index][0].question == record["question"]
+            }
+            logging.info(f"Resuming: {len(done)} of {len(requests)} questions are journaled")
+        journal.reset([done[index] for index in sorted(done)])
+
+        predictions: list[Prediction | None] = [None] * len(requests)
+        for index, record in done.items():
+            predictions[index] = Prediction(
+                sql=record["sql"],
+                report=record["report"],
+                attempts=record["attempts"],
+                seconds=record["seconds"],
+                calls=[tuple(call) for call in record.get("calls", [])],
+            )
+
+        pending = [index for index in range(len(requests)) if index not in done]
+        fresh = model.predict_sql_batch(
+            [requests[index] for index in pending],
+            self.concurrency,
+            on_done=lambda i, prediction: journal.append(
+                pending[i], requests[pending[i]][0].question, prediction
+            ),
+            previous_calls=[
+                previous.get(requests[index][0].question, []) for index in pending
+            ],
+        )
+        for index, prediction in zip(pending, fresh):
+            predictions[index] = prediction
+
+        if self.reuse_from:
+            unchanged = sum(
+                1
+                for prediction in fresh
+                if prediction.attempts and prediction.reused_calls == prediction.attempts
+            )
+            logging.info(
+                f"Reused {unchanged} of {len(fresh)} questions from {self.reuse_from}, "
+                f"{len(fresh) - unchanged} had changed prompts"
+            )
+        return predictions
+
+
+def add_run_arguments(
+    parser: argparse.ArgumentParser,
+    base_url: str,
+    validation_modes: tuple[str, ...] = VALIDATION_MODES,
+):
+    """Options of a benchmark run; `wrapper_kwargs` turns them into wrapper arguments"""
+    parser.add_argument("--out_dir", type=str, default="run_0", help="Output directory")
+    parser.add_argument(
+        "--base_url",
+        type=str,
+        default=base_url,
+        help="Chat API endpoint, e.g. a local stub_llm.py server",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=1, help="Questions evaluated concurrently"
+    )
+    parser.add_argument(
+        "--speculative_candidates",
+        type=int,
+        default=1,
+        help="Completions sampled at once for the first generation, the first valid wins",
+    )
+    parser.add_argument(
+        "--validation_mode",
+        choices=validation_modes,
+        default="limit0",
+        help="How candidate SQL is checked before it is accepted",
+    )
+    parser.add_argument(
+        "--llm_cache",
+        type=str,
+        default="",
+        help="SQLite file with cached LLM responses, e.g. llm_cache.sqlite; off by default",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip questions already answered in out_dir/journal.jsonl",
+    )
+    parser.add_argument(
+        "--reuse_from",
+        type=str,
+        default=None,
+        help="Previous run dir whose journal answers prompts that did not change",
+    )
+    parser.add_argument(
+        "--max_connections",
+        type=int,
+        default=None,
+        help="Size of the shared keep-alive connection pool to the chat API",
+    )
+    parser.add_argument(
+        "--requests_per_minute", type=float, default=None, help="Chat API request budget"
+    )
+    parser.add_argument(
+        "--tokens_per_minute", type=float, default=None, help="Chat API prompt token budget"
+    )
+    parser.add_argument(
+        "--max_in_flight",
+        type=int,
+        default=16,
+        help="Upper bound of the adaptive number of concurrent chat API requests",
+    )
+    parser.add_argument(
+        "--stream_sql",
+        action="store_true",
+        help="Stream completions and stop generating at the end of the SQL block",
+    )
+    parser.add_argument(
+        "--prompt_layout",
+        choices=PROMPT_LAYOUTS,
+        default="template",
+        help="prefix_cache moves per-question sections after the shared schema",
+    )
+    parser.add_argument(
+        "--prompt_token_budget",
+        type=int,
+        default=None,
+        help="Trim gold examples and sample values until the first prompt fits",
+    )
+    parser.add_argument(
+        "--schema_linking",
+        action="store_true",
+        help="Render only the tables and columns relevant to the question",
+    )
+    parser.add_argument(
+        "--gold_index",
+        type=str,
+        default=None,
+        help="Dir of a GoldIndex whose nearest records replace the retrieved gold examples",
+    )
+    parser.add_argument(
+        "--gold_records",
+        type=str,
+        default=None,
+        help="JSON lines of question/sql pairs to build --gold_index from",
+    )
+    parser.add_argument(
+        "--gold_token_budget",
+        type=int,
+        default=None,
+        help="Drop gold examples with a repeated SQL skeleton, then keep diverse ones in budget",
+    )
+    parser.add_argument(
+        "--static_validation",
+        action="store_true",
+        help="Resolve the tables and columns of a query against the schema before running it",
+    )
+
+
+def wrapper_kwargs(args: argparse.Namespace) -> dict:
+    """ScientistWrapper arguments for the options added by `add_run_arguments`"""
+    gold_index = None
+    if args.gold_index and args.gold_records:
+        gold_index = GoldIndex()
+        gold_index.add(GoldIndex.read_records(args.gold_records))
+        gold_index.save(args.gold_index)
+    elif args.gold_index:
+        gold_index = GoldIndex.load(args.gold_index)
+    return {
+        "cache": LLMResponseCache(args.llm_cache) if args.llm_cache else None,
+        "speculative_candidates": args.speculative_candidates,
+        "validation_mode": args.validation_mode,
+        "max_connections": args.max_connections,
+        "rate_limiter": RateLimiter(
+            requests_per_minute=args.requests_per_minute,
+            tokens_per_minute=args.tokens_per_minute,
+            max_concurrency=args.max_in_flight,
+        ),
+        "stream_sql": args.stream_sql,
+        "prompt_layout": args.prompt_layout,
+        "prompt_token_budget": args.prompt_token_budget,
+        "schema_linker": SchemaLinker() if args.schema_linking else None,
+        "gold_selector": gold_index,
+        "gold_diversifier": (
+            GoldDiversifier(args.gold_token_budget) if args.gold_token_budget else None
+        ),
+        "static_validator": SqlStaticValidator() if args.static_validation else None,
+    }
+
+
+def run_benchmark(args: argparse.Namespace, model: ScientistWrapper):
+    """Evaluate `model` on the benchmark and write final_info.json to `args.out_dir`"""
+    easy_medium, total, bucket_counts = ConcurrentBenchRunner(
+        report_manager=None,
+        bench_name="Test",
+        dataset=load_datasets({"vacancies_normalized_duck"})["vacancies_normalized_duck"],
+        output_path=args.out_dir,
+        concurrency=args.concurrency,
+        resume=args.resume,
+        reuse_from=args.reuse_from,
+    ).run(
+        model=model,
+        prompt_name="Test",
+        config=RunConfig(
+            **{
+                "dataset": "vacancies_normalized_duck",
+                "use_stat": True,
+                "use_gold": True,
+                "save_report": False,
+                "top_g": 10
+            }
+        )
+    )
+
+    if model.cache is not None:
+        print(f"LLM cache: {model.cache.stats()}")
+    print(f"HTTP connections: {CONNECTION_METRICS.stats()}")
+    CONNECTION_METRICS.uninstall()
+    if model.rate_limiter is not None:
+        print(f"Rate limiter: {model.rate_limiter.stats()}")
+    print(f"Token usage: {TOKEN_USAGE.stats()}")
+
+    final_info = {
+        "bench":
+            {
+                "means":
+                    {
+                        "easy_medium": easy_medium,
+                        "total": total,
+                        "counts": bucket_counts
+                    }
+            }
+    }
+
+    with open(os.path.join(args.out_dir, "final_info.json"), "w") as f:
+        json.dump(final_info, f, indent=4)
+
+    with open(os.path.join(args.out_dir, "all_results.npy"), "wb") as f:
+        np.save(f, final_info)
@@ -0,0 +1,304 @@
+"""Database schema as the prompts see it: rendered blocks, FK graph, linking."""
+
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+
+from src.text2sql_bench.vector_db import TableInfo
+
+
+class SchemaRenderCache:
+    """Process-wide LRU of rendered schema blocks, shared by all wrapper instances.
+
+    A block is the rendering of one TableInfo and is keyed by the schema type, the
+    rendering variant (such as a sample limit) and a fingerprint of the table
+    contents. The fingerprint is memoized per TableInfo object, so tables reused
+    across questions are not hashed again. Call `invalidate()` when the database
+    schema changes.
+    """
+
+    def __init__(self, max_size: int = 512):
+        self.max_size = max_size
+        self._blocks: OrderedDict[tuple, str] = OrderedDict()
+        # id -> (table_info, fingerprint); holding the object keeps its id unique
+        self._fingerprints: OrderedDict[int, tuple[TableInfo, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def fingerprint(self, table_info: TableInfo) -> str:
+        with self._lock:
+            known = self._fingerprints.get(id(table_info))
+            if known is not None and known[0] is table_info:
+                self._fingerprints.move_to_end(id(table_info))
+                return known[1]
+        # TableInfo and ColumnInfo are data classes, their repr lists every field
+        fingerprint = hashlib.sha1(repr(table_info).encode("utf-8")).hexdigest()
+        with self._lock:
+            self._fingerprints[id(table_info)] = (table_info, fingerprint)
+            if len(self._fingerprints) > self.max_size:
+                self._fingerprints.popitem(last=False)
+        return fingerprint
+
+    def get_or_render(
+        self, table_info: TableInfo, schema_type: str | None, render, variant=None
+    ) -> str:
+        key = (schema_type, variant, self.fingerprint(table_info))
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self._blocks.move_to_end(key)
+                return block
+        block = render(table_info)
+        with self._lock:
+            self._blocks[key] = block
+            if len(self._blocks) > self.max_size:
+                self._blocks.popitem(last=False)
+        return block
+
+    def invalidate(self):
+        with self._lock:
+            self._blocks.clear()
+            self._fingerprints.clear()
+
+
+SCHEMA_CACHE = SchemaRenderCache()
+
+
+class SchemaGraph:
+    """Foreign-key graph of one database with the shortest join path of every table pair.
+
+    Paths are found once, by a breadth-first search from every table, so the joins
+    between two tables are a dict lookup. A join is a foreign key as declared:
+    `(table, column, referenced table, referenced column)`; `joins` lists them all, in
+    declaration order. `columns` holds the lowercase column names of every table, for
+    resolving queries without a database.
+    """
+
+    def __init__(self, tables_info: list[TableInfo]):
+        names = [table_info.name for table_info in tables_info]
+        self.columns: dict[str, frozenset[str]] = {
+            table_info.name.lower(): frozenset(c.name.lower() for c in table_info.cols_info)
+            for table_info in tables_info
+        }
+        self.joins: list[tuple[str, str, str, str]] = []
+        neighbours: dict[str, dict[str, tuple[str, str, str, str]]] = {name: {} for name in names}
+        for table_info in tables_info:
+            for col_info in table_info.cols_info:
+                foreign_key = getattr(col_info, "foreign_key", None) or ""
+                fk_table, _, fk_col = foreign_key.partition(".")
+                if not fk_col:
+                    continue
+                join = (table_info.name, col_info.name, fk_table, fk_col)
+                self.joins.append(join)
+                if fk_table in neighbours and fk_table != table_info.name:
+                    neighbours[table_info.name].setdefault(fk_table, join)
+                    neighbours[fk_table].setdefault(table_info.name, join)
+        self._paths: dict[tuple[str, str], tuple[tuple[str, str, str, str], ...]] = {}
+        for source in neighbours:
+            paths = {source: ()}
+            queue = [source]
+            for table in queue:
+                for neighbour, join in neighbours[table].items():
+                    if neighbour not in paths:
+                        paths[neighbour] = paths[table] + (join,)
+                        queue.append(neighbour)
+            for target, path in paths.items():
+                self._paths[(source, target)] = path
+
+    def path(self, source: str, target: str) -> tuple[tuple[str, str, str, str], ...] | None:
+        """Joins of the shortest path between two tables, None when they are not connected"""
+        return self._paths.get((source, target))
+
+    def join_chain(self, tables: list[str]) -> list[tuple[str, str, str, str]]:
+        """Every join between `tables` and the tables on the paths connecting them.
+
+        Each table is connected by its shortest path to those before it; the paths only
+        choose the tables, all foreign keys declared between them are returned, self
+        references and parallel keys included.
+        """
+        connected: list[str] = []
+        for table in tables:
+            paths = [path for path in (self.path(c, table) for c in connected) if path is not None]
+            if paths:
+                for join in min(paths, key=len):
+                    connected.extend(t for t in (join[0], join[2]) if t not in connected)
+            if table not in connected:
+                connected.append(table)
+        chosen = set(connected)
+        return [join for join in self.joins if join[0] in chosen and join[2] in chosen]
+
+
+class SchemaGraphCache:
+    """Process-wide LRU of SchemaGraph, keyed by the fingerprints of all tables of a schema"""
+
+    def __init__(self, max_size: int = 32):
+        self.max_size = max_size
+        self._graphs: OrderedDict[tuple[str, ...], SchemaGraph] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, tables_info: list[TableInfo]) -> SchemaGraph:
+        key = tuple(SCHEMA_CACHE.fingerprint(table_info) for table_info in tables_info)
+        with self._lock:
+            graph = self._graphs.get(key)
+            if graph is not None:
+                self._graphs.move_to_end(key)
+                return graph
+        graph = SchemaGraph(tables_info)
+        with self._lock:
+            self._graphs[key] = graph
+            if len(self._graphs) > self.max_size:
+                self._graphs.popitem(last=False)
+        return graph
+
+
+SCHEMA_GRAPHS = SchemaGraphCache()
+
+
+IDENTIFIER_WORD = re.compile(r"[^\W_]+")
+_CAMEL_CASE = re.compile(r"(?<=[a-zа-яё])(?=[A-ZА-ЯЁ])")
+
+
+def _stems(text) -> frozenset[str]:
+    """Lowercase 5 letter prefixes of the words in `text`, identifiers split on _ and case"""
+    words = IDENTIFIER_WORD.findall(_CAMEL_CASE.sub(" ", str(text or "")))
+    return frozenset(word.lower()[:5] for word in words if len(word) >= 3)
+
+
+@dataclass(frozen=True)
+class _ColumnTerms:
+    name: str
+    name_stems: frozenset[str]
+    description_stems: frozenset[str]
+    values: tuple[str, ...]
+    is_key: bool
+
+
+class SchemaLinker:
+    """Prunes the schema of a question to the tables and columns it is likely to need.
+
+    Tables and columns are scored against the question by their names and
+    descriptions, with words compared by a 5 letter prefix that absorbs most Russian
+    and English inflection, and by sample values quoted in the question. The best
+    `max_tables` tables are kept together with the tables on the foreign-key paths
+    joining them, and of each table the matching columns plus its key columns.
+
+    Pruning errs on the side of recall: a question matching nothing keeps the whole
+    schema, narrow tables and tables matched by name alone are kept whole, the schema
+    is left as is when pruning saves less than `min_saving` of the columns, and the
+    retries of a question see the full schema again.
+    """
+
+    def __init__(
+        self,
+        max_tables: int = 4,
+        min_table_columns: int = 8,
+        min_saving: float = 0.2,
+        max_size: int = 4096,
+    ):
+        self.max_tables = max_tables
+        self.min_table_columns = min_table_columns
+        self.min_saving = min_saving
+        self.max_size = max_size
+        # fingerprint -> (table name stems, column terms)
+        self._terms: OrderedDict[str, tuple[frozenset[str], tuple[_ColumnTerms, ...]]] = OrderedDict()
+        # (fingerprint, kept columns) -> pruned TableInfo, reused so its render is cached
+        self._pruned: OrderedDict[tuple[str, tuple[str, ...]], TableInfo] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, store: OrderedDict, key, value):
+        with self._lock:
+            store[key] = value
+            if len(store) > self.max_size:
+                store.popitem(last=False)
+        return value
+
+    def _table_terms(self, table_info: TableInfo) -> tuple[frozenset[str], tuple[_ColumnTerms, ...]]:
+        fingerprint = SCHEMA_CACHE.fingerprint(table_info)
+        with self._lock:
+            terms = self._terms.get(fingerprint)
+        if terms is not None:
+            return terms
+        columns = []
+        for col_info in table_info.cols_info:
+            values = col_info.categories if col_info.categories else col_info.samples
+            foreign_key = getattr(col_info, "foreign_key", None)
+            name = col_info.name.lower()
+            columns.append(
+                _ColumnTerms(
+                    name=col_info.name,
+                    name_stems=_stems(col_info.name),
+                    description_stems=_stems(col_info.description),
+                    values=tuple(
+                        str(v).lower() for v in (values or ()) if v is not None and len(str(v)) >= 3
+                    ),
+                    is_key=bool(foreign_key) or name == "id" or name.endswith("_id"),
+                )
+            )
+        return self._remember(self._terms, fingerprint, (_stems(table_info.name), tuple(columns)))
+
+    @staticmethod
+    def _column_score(column: _ColumnTerms, question: str, question_stems: frozenset[str]) -> int:
+        score = 2 * len(column.name_stems & question_stems)
+        score += len(column.description_stems & question_stems)
+        if any(value in question for value in column.values):
+            score += 3
+        return score
+
+    def link(self, question: str, tables_info: list[TableInfo]) -> list[TableInfo]:
+        question_lower = question.lower()
+        question_stems = _stems(question)
+        terms = [self._table_terms(table_info) for table_info in tables_info]
+        column_scores = [
+            [self._column_score(column, question_lower, question_stems) for column in columns]
+            for _, columns in terms
+        ]
+        table_scores = [
+            2 * len(name_stems & question_stems) + max(scores, default=0)
+            for (name_stems, _), scores in zip(terms, column_scores)
+        ]
+        ranked = sorted(range(len(tables_info)), key=lambda i: -table_scores[i])
+        kept = [i for i in ranked[: self.max_tables] if table_scores[i] > 0]
+        if not kept:
+            return tables_info
+
+        index = {table_info.name: i for i, table_info in enumerate(tables_info)}
+        join_columns: dict[int, set[str]] = {}
+        chain = SCHEMA_GRAPHS.get(tables_info).join_chain([tables_info[i].name for i in kept])
+        for table, column, fk_table, fk_col in chain:
+            for name, join_column in ((table, column), (fk_table, fk_col)):
+                join_columns.setdefault(index[name], set()).add(join_column)
+                if index[name] not in kept:
+                    kept.append(index[name])
+
+        pruned = []
+        total_columns = sum(len(table_info.cols_info) for table_info in tables_info)
+        kept_columns = 0
+        for i in sorted(kept):
+            table_info, (_, columns), scores = tables_info[i], terms[i], column_scores[i]
+            if len(columns) <= self.min_table_columns or not any(scores):
+                pruned.append(table_info)
+                kept_columns += len(columns)
+                continue
+            needed = join_columns.get(i, set())
+            names = tuple(
+                column.name
+                for column, score in zip(columns, scores)
+                if score > 0 or column.is_key or column.name in needed
+            )
+            kept_columns += len(names)
+            key = (SCHEMA_CACHE.fingerprint(table_info), names)
+            with self._lock:
+                table = self._pruned.get(key)
+            if table is None:
+                cols_info = [c for c in table_info.cols_info if c.name in names]
+                table = self._remember(self._pruned, key, replace(table_info, cols_info=cols_info))
+            pruned.append(table)
+        if kept_columns > (1 - self.min_saving) * total_columns:
+            return tables_info
+        logging.debug(
+            f"Schema pruned to {kept_columns} of {total_columns} columns: "
+            f"{[table_info.name for table_info in pruned]}"
+        )
+        return pruned
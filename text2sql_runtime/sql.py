@@ -0,0 +1,429 @@
+"""SQL found in completions and checked against the schema before it is run."""
+
+import difflib
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+
+try:
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.optimizer.scope import traverse_scope
+except ImportError:  # queries are only validated by the database
+    sqlglot = None
+
+
+VALIDATION_MODES = ("limit0", "explain", "execute")
+
+
+@dataclass(frozen=True)
+class StaticIssue:
+    """A problem of a query found without running it, worded like the DuckDB error"""
+
+    kind: str
+    identifier: str
+    message: str
+
+
+class StaticValidationError(ValueError):
+    """Issues SqlStaticValidator found in a query, raised before it reaches the database"""
+
+    def __init__(self, issues: list[StaticIssue]):
+        self.issues = issues
+        super().__init__("\n".join(issue.message for issue in issues))
+
+
+class SqlStaticValidator:
+    """Resolves the tables and columns of a query against the schema, without a database.
+
+    The query is parsed with sqlglot and split into scopes, and every column is looked
+    up in the sources of its scope, or of an enclosing one for correlated subqueries.
+    This finds unknown tables and columns, ambiguous column names, selected columns
+    that are neither grouped nor aggregated, and expressions that lost an operator.
+    Issues are worded like the DuckDB errors, so the regeneration prompts and the
+    error patterns read them as they would the database message.
+
+    Whatever cannot be resolved with certainty, such as table functions, star
+    projections, unknown functions or a query sqlglot fails to parse, is left to the
+    database: a query rejected here has to be one the database rejects too.
+    """
+
+    # columns every DuckDB table has without declaring them
+    PSEUDO_COLUMNS = frozenset({"rowid"})
+
+    def __init__(self, dialect: str = "duckdb", cache_size: int = 1024):
+        self.dialect = dialect
+        # speculative candidates and regenerations often repeat a query verbatim
+        self._scopes = lru_cache(maxsize=cache_size)(self._parse)
+
+    def _parse(self, sql: str) -> "tuple[exp.Expression, tuple] | None":
+        try:
+            expression = sqlglot.parse_one(sql, read=self.dialect)
+            return expression, tuple(traverse_scope(expression))
+        except sqlglot.errors.SqlglotError:
+            return None
+
+    def validate(self, sql: str, schema: dict[str, frozenset[str]]) -> list[StaticIssue]:
+        """Issues of `sql`, given the lowercase column names of every table of the schema"""
+        if sqlglot is None or not schema:
+            return []
+        parsed = self._scopes(sql)
+        if parsed is None:
+            # sqlglot does not know every DuckDB construct, the database has the last word
+            return []
+        expression, scopes = parsed
+        issues: dict[StaticIssue, None] = {}
+        for alias in expression.find_all(exp.Alias):
+            # `(salary_from  salary_to)` parses as an alias, which no engine accepts there
+            if isinstance(alias.parent, exp.Paren):
+                message = f'Parser Error: syntax error at or near "{alias.alias}"'
+                issues[StaticIssue("syntax", alias.alias, message)] = None
+        for scope in scopes:
+            for issue in self._reference_issues(scope, schema):
+                issues[issue] = None
+            if isinstance(scope.expression, exp.Select):
+                for issue in self._group_by_issues(scope):
+                    issues[issue] = None
+        return list(issues)
+
+    def _source_columns(self, scope, name: str, schema) -> frozenset[str] | None:
+        """Columns of the source `name` of `scope`, None when they are not known"""
+        node, source = scope.selected_sources[name]
+        # a derived table may rename its columns, as in `(SELECT ...) AS t(a, b)`
+        if isinstance(node.parent, exp.Subquery):
+            node = node.parent
+        alias = node.args.get("alias")
+        if alias is not None and alias.columns:
+            return frozenset(column.name.lower() for column in alias.columns)
+        if isinstance(source, exp.Table):
+            if not isinstance(source.this, exp.Identifier) or source.db.lower() not in ("", "main"):
+                return None
+            columns = schema.get(source.name.lower())
+            return columns | self.PSEUDO_COLUMNS if columns is not None else None
+        query = getattr(source, "expression", None)
+        if isinstance(query, exp.Query) and not query.is_star:
+            return frozenset(name.lower() for name in query.named_selects)
+        return None
+
+    def _reference_issues(self, scope, schema) -> list[StaticIssue]:
+        issues = []
+        for _, source in scope.selected_sources.values():
+            if (
+                isinstance(source, exp.Table)
+                and isinstance(source.this, exp.Identifier)
+                and not source.db
+                and source.name.lower() not in schema
+            ):
+                issues.append(
+                    StaticIssue(
+                        "table",
+                        source.name,
+                        f"Catalog Error: Table with name {source.name} does not exist!",
+                    )
+                )
+        if issues:
+            # the columns of a missing table cannot be told apart from wrong ones
+            return issues
+
+        query = scope.expression
+        aliases, using = set(), set()
+        if isinstance(query, exp.Select):
+            # DuckDB resolves the aliases of the select list in the other clauses too
+            aliases = {p.alias.lower() for p in query.expressions if isinstance(p, exp.Alias)}
+            for join in query.args.get("joins") or []:
+                if join.args.get("method") or join.args.get("kind") == "NATURAL":
+                    using = None
+                    break
+                using.update(column.name.lower() for column in join.args.get("using") or [])
+
+        for column in scope.columns:
+            # columns of subqueries without a scope of their own, such as IN (SELECT ...)
+            if isinstance(column.this, exp.Star) or column.find_ancestor(exp.Query) is not query:
+                continue
+            name = column.name.lower()
+            if column.table:
+                issue = self._qualified_issue(scope, column, schema)
+            elif name not in aliases:
+                issue = self._unqualified_issue(scope, column.name, schema, using)
+            else:
+                issue = None
+            if issue is not None:
+                issues.append(issue)
+        return issues
+
+    def _qualified_issue(self, scope, column: "exp.Column", schema) -> StaticIssue | None:
+        table, name = column.table.lower(), column.name.lower()
+        outer = scope
+        while outer is not None:
+            sources = {source.lower(): source for source in outer.selected_sources}
+            if table in sources:
+                columns = self._source_columns(outer, sources[table], schema)
+                if columns is None or name in columns:
+                    return None
+                return StaticIssue(
+                    "column",
+                    column.name,
+                    f'Binder Error: Table "{column.table}" does not have a column named '
+                    f'"{column.name}"' + self._candidates(name, columns),
+                )
+            outer = outer.parent
+        # a struct column accessed by its field, as in `address.city`
+        if self._unqualified_issue(scope, column.table, schema, None) is None:
+            return None
+        return StaticIssue(
+            "table", column.table, f'Binder Error: Referenced table "{column.table}" not found!'
+        )
+
+    def _unqualified_issue(
+        self, scope, column: str, schema, using: set[str] | None
+    ) -> StaticIssue | None:
+        name = column.lower()
+        known: set[str] = set()
+        outer = scope
+        while outer is not None:
+            matches = 0
+            for source in outer.selected_sources:
+                columns = self._source_columns(outer, source, schema)
+                if columns is None:
+                    return None
+                known |= columns
+                matches += name in columns
+            if matches > 1 and outer is scope and using is not None and name not in using:
+                return StaticIssue(
+                    "ambiguous",
+                    column,
+                    f'Binder Error: Ambiguous reference to column name "{column}"',
+                )
+            if matches:
+                return None
+            outer = outer.parent
+        return StaticIssue(
+            "column",
+            column,
+            f'Binder Error: Referenced column "{column}" not found in FROM clause!'
+            + self._candidates(name, known),
+        )
+
+    @staticmethod
+    def _candidates(name: str, columns) -> str:
+        close = difflib.get_close_matches(name, sorted(columns), n=3, cutoff=0.6)
+        return "\nCandidate bindings: " + ", ".join(f'"{c}"' for c in close) if close else ""
+
+    def _group_by_issues(self, scope) -> list[StaticIssue]:
+        select = scope.expression
+        group = select.args.get("group")
+        projections = select.expressions
+        keys = []
+        if group is None:
+            if not any(self._aggregates(projection) for projection in projections):
+                return []
+        elif group.args.get("all") or any(
+            group.args.get(arg) for arg in ("grouping_sets", "cube", "rollup")
+        ):
+            return []
+        else:
+            for key in group.expressions:
+                if isinstance(key, exp.Literal) and key.is_int:
+                    if not 0 < int(key.name) <= len(projections):
+                        return []
+                    key = projections[int(key.name) - 1]
+                elif isinstance(key, exp.Column) and not key.table:
+                    # GROUP BY an alias of the select list
+                    key = next(
+                        (
+                            p
+                            for p in projections
+                            if isinstance(p, exp.Alias) and p.alias.lower() == key.name.lower()
+                        ),
+                        key,
+                    )
+                keys.append(key.unalias())
+        key_sql = {key.sql(dialect=self.dialect).lower() for key in keys}
+        key_columns = {key.name.lower() for key in keys if isinstance(key, exp.Column)}
+
+        issues = []
+        for projection in projections:
+            expression = projection.unalias()
+            if expression.sql(dialect=self.dialect).lower() in key_sql:
+                continue
+            if expression.find(exp.Anonymous):
+                # a function sqlglot does not know may well be an aggregate
+                continue
+            for column in expression.find_all(exp.Column):
+                if isinstance(column.this, exp.Star) or column.name.lower() in key_columns:
+                    continue
+                owner = column.find_ancestor(exp.AggFunc, exp.Filter, exp.Window, exp.Query)
+                if owner is not select:
+                    continue
+                if column.table and column.table not in scope.selected_sources:
+                    continue
+                issues.append(
+                    StaticIssue(
+                        "group_by",
+                        column.name,
+                        f'Binder Error: column "{column.name}" must appear in the GROUP BY clause '
+                        "or must be part of an aggregate function.",
+                    )
+                )
+        return issues
+
+    @staticmethod
+    def _aggregates(projection: "exp.Expression") -> bool:
+        return any(
+            aggregate.find_ancestor(exp.Window, exp.Query) is projection.find_ancestor(exp.Query)
+            for aggregate in projection.find_all(exp.AggFunc)
+        )
+
+
+def sql_block_closed(text: str) -> bool:
+    """Whether the answer has a closed ```sql block; drafts inside <think> do not count"""
+    answer = text.rfind("</think>")
+    answer = 0 if answer == -1 else answer + len("</think>")
+    if text.find("<think>", answer) != -1:
+        # the model is still thinking
+        return False
+    start = text.find("```sql", answer)
+    return start != -1 and text.find("```", start + len("```sql")) != -1
+
+
+@dataclass(frozen=True)
+class SqlExtraction:
+    """The query of a model response and the text around it"""
+
+    sql: str
+    reasoning: str
+
+
+# the parts of a response are found with str.find, which is several times faster than
+# scanning for them with one alternation; the patterns below only run at known offsets
+_FENCE_LANGUAGE = re.compile(r"([\w+-]*)[ \t]*(?:\r?\n|\\n)?")
+# "SQL:" labels such as the "3. SQL:" of a numbered answer
+_SQL_LABEL = re.compile(r"SQL(?<!\wSQL)(?:[ -]?запрос)?[ \t]*:")
+_STATEMENT_START = re.compile(r"^[ \t]*(?:SELECT|WITH)\b", re.IGNORECASE | re.MULTILINE)
+# where the answer starts after a <think> that is never closed
+_ANSWER_START = re.compile(r"```|^[ \t]*(?:SELECT|WITH)\b", re.IGNORECASE | re.MULTILINE)
+_BLANK_LINE = re.compile(r"\n[ \t\r]*\n")
+# comments and escaped newlines, a backslash-n the model sent as text
+_SQL_BREAKS = (r"--[^\n]*", r"/\*.*?(?:\*/|\Z)", r"\\n")
+# literals, kept whole so that whitespace, "--" and ";" in them are left alone, the end of
+# the statement, and a break with the whitespace and breaks after it
+_SQL_TOKEN = re.compile(
+    "|".join(
+        [r"'(?:[^']|'')*'?", r'"(?:[^"]|"")*"?', ";"]
+        + [rf"{start}(?:\s|{'|'.join(_SQL_BREAKS)})*" for start in _SQL_BREAKS]
+    ),
+    re.DOTALL,
+)
+
+
+def _squeeze(code: str) -> str:
+    """`code` with each run of whitespace turned into one space"""
+    words = " ".join(code.split())
+    if not words:
+        return " " if code else ""
+    return " " * code[0].isspace() + words + " " * code[-1].isspace()
+
+
+def _split_thinks(text: str) -> tuple[str, list[str]]:
+    """The response without its think blocks, and their contents"""
+    if "<think>" not in text:
+        return text, []
+    pieces: list[str] = []
+    thinks: list[str] = []
+    position = 0
+    while True:
+        opened = text.find("<think>", position)
+        if opened == -1:
+            break
+        pieces.append(text[position:opened])
+        content = opened + len("<think>")
+        closed = text.find("</think>", content)
+        if closed == -1:
+            # an unterminated think ends where the answer starts
+            answer = _ANSWER_START.search(text, content)
+            closed = position = answer.start() if answer else len(text)
+        else:
+            position = closed + len("</think>")
+        thinks.append(text[content:closed].strip())
+    pieces.append(text[position:])
+    return "".join(pieces), thinks
+
+
+def extract_sql(text: str) -> SqlExtraction:
+    """Find the query in a model response.
+
+    A ```sql block wins over a "SQL:" label, which wins over a fence without a
+    language; without any of them the query is the statement starting at the first
+    line opening with SELECT or WITH, up to a blank line, or the whole response.
+    Think blocks are never part of it. The query is then put on one line: whitespace
+    and comments outside literals become single spaces, and everything after the
+    first ";" is dropped.
+    """
+    body, thinks = _split_thinks(text)
+    # (start, end, code start, code end) of the fences, until the first ```sql one
+    fences: list[tuple[int, int, int, int]] = []
+    sql_block = None
+    position = 0
+    while sql_block is None:
+        opened = body.find("```", position)
+        if opened == -1:
+            break
+        language = _FENCE_LANGUAGE.match(body, opened + len("```"))
+        closed = body.find("```", language.end())
+        position = len(body) if closed == -1 else closed + len("```")
+        block = (opened, position, language.end(), len(body) if closed == -1 else closed)
+        if language.group(1).lower() == "sql":
+            sql_block = block
+        fences.append(block)
+
+    label = label_end = None
+    if sql_block is None:
+        position = 0
+        while True:
+            match = _SQL_LABEL.search(body, position)
+            if match is None:
+                break
+            position = match.end()
+            if any(start <= match.start() < end for start, end, _, _ in fences):
+                continue
+            # a label runs up to the next fence, or to the end of the response
+            label_end = next(
+                (start for start, _, _, _ in fences if start > position), len(body)
+            )
+            if body[position:label_end].strip():
+                label = position
+                break
+            # "SQL:" followed by the fence holding the query
+
+    if sql_block is not None or (label is None and fences):
+        start, end, code_start, code_end = sql_block or fences[0]
+        sql, outside = body[code_start:code_end], body[:start] + body[end:]
+    elif label is not None:
+        sql, outside = body[label:label_end], body[:label] + body[label_end:]
+    else:
+        statement = _STATEMENT_START.search(body)
+        if statement is None:
+            sql, outside = body, ""
+        else:
+            blank = _BLANK_LINE.search(body, statement.end())
+            end = blank.start() if blank else len(body)
+            sql, outside = body[statement.start() : end], body[: statement.start()] + body[end:]
+
+    # between two tokens is code, where only whitespace changes
+    parts: list[str] = []
+    position = 0
+    for token in _SQL_TOKEN.finditer(sql):
+        parts.append(_squeeze(sql[position : token.start()]))
+        position = token.end()
+        piece = token.group(0)
+        if piece == ";":
+            parts.append(piece)
+            break
+        if piece[0] in "'\"":
+            parts.append(piece)
+        elif not parts[-1].endswith(" "):
+            parts.append(" ")
+    else:
+        parts.append(_squeeze(sql[position:]))
+    reasoning = "\n".join(filter(None, thinks + [outside.strip()]))
+    return SqlExtraction("".join(parts).strip(), reasoning)
@@ -0,0 +1,272 @@
+"""Local stand-in for the chat completion API the experiments call.
+
+Serves `POST .../chat/completions` in the shape GigaChat and OpenAI clients expect,
+including `stream` responses, so the wrapper can be benchmarked without network
+access:
+
+    python ../text2sql_runtime/stub_llm.py --replay run_8 --latency lognormal:-0.5,0.4 --port 8765
+    python experiment.py --base_url http://127.0.0.1:8765 --concurrency 8
+
+With `--replay` the answer is the SQL a previous run predicted for the question
+found in the last user message (questions come from result.log, SQL from the
+predictions.sql next to it). Anything else gets `--response`.
+"""
+
+import argparse
+import glob
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def load_replay(run_dir: str) -> dict[str, str]:
+    """Question -> predicted SQL from the result.log files under `run_dir`"""
+    answers = {}
+    for log_path in glob.glob(os.path.join(run_dir, "**", "result.log"), recursive=True):
+        with open(log_path) as f:
+            log = f.read()
+        questions = re.findall(r"^\tQuestion: '(.*)'$", log, flags=re.MULTILINE)
+        predictions_path = os.path.join(os.path.dirname(log_path), "predictions.sql")
+        sqls = []
+        if os.path.exists(predictions_path):
+            with open(predictions_path) as f:
+                sqls = f.read().splitlines()
+        if len(sqls) != len(questions):
+            # fall back to the log itself; questions that failed to parse have no Pred sql
+            sqls = []
+            for block in re.split(r"^\tQuestion: ", log, flags=re.MULTILINE)[1:]:
+                match = re.search(r"^\t\tPred sql: (.*)$", block, flags=re.MULTILINE)
+                sqls.append(match.group(1) if match else None)
+        for question, sql in zip(questions, sqls):
+            if sql:
+                answers[question] = sql
+    return answers
+
+
+def parse_latency(spec: str):
+    """`fixed:S`, `uniform:A,B`, `normal:MU,SIGMA` or `lognormal:MU,SIGMA`, in seconds"""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",")] if params else []
+    rnd = random.Random(0)
+    lock = threading.Lock()
+    samplers = {
+        "fixed": lambda: values[0],
+        "uniform": lambda: rnd.uniform(values[0], values[1]),
+        "normal": lambda: rnd.gauss(values[0], values[1]),
+        "lognormal": lambda: math.exp(rnd.gauss(values[0], values[1])),
+    }
+    if kind not in samplers:
+        raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample() -> float:
+        with lock:
+            return max(0.0, samplers[kind]())
+
+    return sample
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "StubServer"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"message": f"Unknown path {self.path}"})
+            return
+        request = json.loads(body or b"{}")
+        content = self.server.answer(request.get("messages", []))
+        time.sleep(self.server.latency())
+        if self.server.failure():
+            self._send_json(self.server.fail_status, {"message": "Injected by stub_llm.py"})
+            return
+        if request.get("stream"):
+            self._send_stream(request, content)
+        else:
+            time.sleep(self.server.generation_time(content))
+            self._send_json(200, self._completion(request, content))
+
+    def _usage(self, request: dict, content: str) -> dict:
+        prompt = "".join(
+            f"{m.get('role')}:{m.get('content') or ''}" for m in request.get("messages", [])
+        )
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "precached_prompt_tokens": self.server.cached_prefix(prompt) // 4,
+        }
+
+    def _completion(self, request: dict, content: str) -> dict:
+        return {
+            "id": f"stub-{time.time_ns()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model") or "stub",
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": self._usage(request, content),
+        }
+
+    def _send_json(self, status: int, payload: dict):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, request: dict, content: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        step = max(1, self.server.chunk_chars)
+        pieces = [content[i : i + step] for i in range(0, len(content), step)] or [""]
+        for i, piece in enumerate(pieces):
+            last = i == len(pieces) - 1
+            chunk = {
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model") or "stub",
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"role": "assistant", "content": piece},
+                        "finish_reason": "stop" if last else None,
+                    }
+                ],
+            }
+            if last:
+                chunk["usage"] = self._usage(request, content)
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.server.generation_time(piece))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 makes bursts of concurrent connects wait for a SYN retry
+    request_queue_size = 128
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        answers: dict[str, str],
+        response: str,
+        latency,
+        chunk_chars: int = 16,
+        tokens_per_second: float = 0.0,
+        fail_rate: float = 0.0,
+        fail_status: int = 429,
+        verbose: bool = False,
+    ):
+        super().__init__(address, StubHandler)
+        # longest first, so a question is not shadowed by one it contains
+        self.answers = sorted(answers.items(), key=lambda item: -len(item[0]))
+        self.response = response
+        self.latency = latency
+        self.chunk_chars = chunk_chars
+        self.tokens_per_second = tokens_per_second
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.verbose = verbose
+        self._random = random.Random(0)
+        self._lock = threading.Lock()
+        self._prompts = deque(maxlen=256)
+
+    def cached_prefix(self, prompt: str) -> int:
+        """Characters of `prompt` a provider prefix cache would have seen before"""
+        with self._lock:
+            cached = max((len(os.path.commonprefix([prompt, seen])) for seen in self._prompts), default=0)
+            self._prompts.append(prompt)
+        return cached
+
+    def generation_time(self, text: str) -> float:
+        # roughly four characters per token
+        return len(text) / 4 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def failure(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.fail_rate
+
+    def answer(self, messages: list[dict]) -> str:
+        user_messages = [m.get("content") or "" for m in messages if m.get("role") == "user"]
+        text = user_messages[-1] if user_messages else ""
+        for question, sql in self.answers:
+            if question in text:
+                return f"```sql\n{sql}\n```"
+        return self.response
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stub of the chat completion API")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--replay", type=str, default=None, help="Run dir whose result.log answers are replayed"
+    )
+    parser.add_argument(
+        "--response",
+        type=str,
+        default="```sql\nSELECT 1\n```",
+        help="Answer for requests without a replayed question",
+    )
+    parser.add_argument(
+        "--latency",
+        type=str,
+        default="fixed:0",
+        help="Delay before answering: fixed:S, uniform:A,B, normal:MU,SIGMA or lognormal:MU,SIGMA",
+    )
+    parser.add_argument("--chunk_chars", type=int, default=16, help="Characters per stream chunk")
+    parser.add_argument(
+        "--tokens_per_second",
+        type=float,
+        default=0.0,
+        help="Simulated generation speed after the latency, 0 answers at once",
+    )
+    parser.add_argument(
+        "--fail_rate", type=float, default=0.0, help="Share of requests answered with an error"
+    )
+    parser.add_argument(
+        "--fail_status", type=int, default=429, help="HTTP status of the injected errors"
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    answers = load_replay(args.replay) if args.replay else {}
+    server = StubServer(
+        (args.host, args.port),
+        answers,
+        args.response,
+        parse_latency(args.latency),
+        chunk_chars=args.chunk_chars,
+        tokens_per_second=args.tokens_per_second,
+        fail_rate=args.fail_rate,
+        fail_status=args.fail_status,
+        verbose=args.verbose,
+    )
+    print(f"Serving {len(answers)} replayed answers on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
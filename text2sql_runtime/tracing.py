@@ -0,0 +1,56 @@
+"""Per-question state of a batch: buffered progress messages, LLM traffic, results."""
+
+import contextvars
+from dataclasses import dataclass, field
+
+
+report_lines: contextvars.ContextVar[list[str] | None] = contextvars.ContextVar(
+    "report_lines", default=None
+)
+
+
+def report(message: str):
+    """Print a progress message, or keep it for later if the question runs in a batch.
+
+    BenchRunner collects stdout into result.log, so messages of concurrently evaluated
+    questions are buffered and printed when the question is replayed in order.
+    """
+    lines = report_lines.get()
+    if lines is None:
+        print(message)
+    else:
+        lines.append(message)
+
+
+@dataclass
+class QuestionTrace:
+    """LLM traffic of the question evaluated in the current batch task."""
+
+    calls: list[tuple[str, str]] = field(default_factory=list)
+    # responses recorded by a previous run, by prompt hash, in the order they came
+    previous: dict[str, list[str]] = field(default_factory=dict)
+    reused: int = 0
+    connects: int = 0
+    connect_seconds: float = 0.0
+    prompt_tokens: int = 0
+    cached_prompt_tokens: int = 0
+
+
+question_trace: contextvars.ContextVar[QuestionTrace | None] = contextvars.ContextVar(
+    "question_trace", default=None
+)
+
+
+@dataclass
+class Prediction:
+    sql: str
+    report: list[str] = field(default_factory=list)
+    error: Exception | None = None
+    attempts: int = 0
+    seconds: float = 0.0
+    calls: list[tuple[str, str]] = field(default_factory=list)
+    reused_calls: int = 0
+    connects: int = 0
+    connect_seconds: float = 0.0
+    prompt_tokens: int = 0
+    cached_prompt_tokens: int = 0
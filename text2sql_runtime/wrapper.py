@@ -0,0 +1,723 @@
+"""Base of the experiment wrappers: chat client, prompts and SQL validation."""
+
+import asyncio
+import logging
+import random
+import re
+import threading
+import time
+
+import httpx
+from langchain.schema import HumanMessage, SystemMessage
+from langchain_core.messages import AIMessage, BaseMessage
+from src.text2sql_bench.core.model import ContextData
+from src.text2sql_bench.db import DbConnection
+from src.text2sql_bench.model_wrappers.wrapper import ModelWrapper
+from src.text2sql_bench.vector_db import GoldRecord, TableInfo
+from text2sql_runtime.gold import GoldDiversifier, GoldIndex
+from text2sql_runtime.llm import (
+    CHAT_MODELS,
+    TOKEN_USAGE,
+    LLMResponseCache,
+    RateLimiter,
+    response_status,
+    retry_after,
+)
+from text2sql_runtime.prompts import PROMPT_LAYOUTS, SHARED_SECTIONS, PromptBudget, PromptFragments
+from text2sql_runtime.schema import SCHEMA_CACHE, SCHEMA_GRAPHS, SchemaLinker
+from text2sql_runtime.sql import (
+    VALIDATION_MODES,
+    SqlStaticValidator,
+    StaticValidationError,
+    extract_sql,
+    sql_block_closed,
+)
+from text2sql_runtime.tracing import Prediction, QuestionTrace, question_trace, report_lines
+
+
+_SECTION_TAIL = re.compile(r"(?:\s*\{(?:hints|ddl|gold|stats)\})+\s*$")
+
+
+class ScientistWrapper(ModelWrapper):
+    """Chat model wrapper the experiments build on, all but their `apredict_sql`.
+
+    Wrappers with the same connection settings share one chat client; candidate SQL
+    is validated as `validation_mode` says, one of the `validation_modes` a subclass
+    supports.
+    """
+
+    validation_modes = VALIDATION_MODES
+
+    def __init__(
+        self,
+        model: str,
+        base_url: str,
+        verify_ssl_certs: bool,
+        temperature: float,
+        timeout: int,
+        prompt_data: dict[str, str],
+        profanity_check: bool = False,
+        user: str | None = None,
+        password: str | None = None,
+        cert_file: str | None = None,
+        key_file: str | None = None,
+        credentials: str | None = None,
+        model_name: str | None = "deepseek-coder-v2",
+        retries_num: int = 3,
+        schema_type: str | None = None,
+        cache: "LLMResponseCache | None" = None,
+        hint_filter_concurrency: int = 4,
+        speculative_candidates: int = 1,
+        speculative_temperature_step: float = 0.1,
+        validation_mode: str = "limit0",
+        max_connections: int | None = None,
+        rate_limiter: "RateLimiter | None" = None,
+        transport_retries: int = 4,
+        transport_backoff: float = 1.0,
+        transport_backoff_max: float = 60.0,
+        stream_sql: bool = False,
+        prompt_layout: str = "template",
+        prompt_token_budget: int | None = None,
+        schema_linker: "SchemaLinker | None" = None,
+        gold_selector: "GoldIndex | None" = None,
+        gold_top_k: int = 10,
+        gold_diversifier: "GoldDiversifier | None" = None,
+        static_validator: "SqlStaticValidator | None" = None,
+        **model_kwargs,
+    ):
+        chat_kwargs = dict(
+            model=model,
+            base_url=base_url,
+            cert_file=cert_file,
+            key_file=key_file,
+            user=user,
+            password=password,
+            credentials=credentials,
+            access_token=credentials,
+            verify_ssl_certs=verify_ssl_certs,
+            profanity_check=profanity_check,
+            temperature=temperature,
+            timeout=timeout,
+            **model_kwargs,
+        )
+        if max_connections is not None:
+            # also lifts httpx's default cap of 20 idle keep-alive connections
+            chat_kwargs["max_connections"] = max_connections
+        if stream_sql:
+            # GigaChat marks `streaming` as explicitly set, and langchain then refuses to
+            # stream even in astream unless it is on
+            chat_kwargs["streaming"] = True
+        self._init_prompt(prompt_data)
+        # predict_sql is a thin synchronous facade over apredict_sql. Wrappers with the
+        # same connection settings share one chat client, so its keep-alive connection
+        # pool, and the event loop that pool is bound to.
+        self.model, self._loop = CHAT_MODELS.get(**chat_kwargs)
+        self.model_name = model_name
+
+        self.retries_num = retries_num
+        self.schema_type = schema_type
+        self.cache = cache
+        self.hint_filter_concurrency = hint_filter_concurrency
+        self.speculative_candidates = speculative_candidates
+        self.speculative_temperature_step = speculative_temperature_step
+        if validation_mode not in self.validation_modes:
+            raise ValueError(f"Unknown validation_mode: {validation_mode}")
+        self.validation_mode = validation_mode
+        self.rate_limiter = rate_limiter
+        self.transport_retries = transport_retries
+        self.transport_backoff = transport_backoff
+        self.transport_backoff_max = transport_backoff_max
+        self.stream_sql = stream_sql
+        # everything besides the model, temperature and messages that changes the answer,
+        # so completions of a stub_llm.py server are never served to the real API
+        self._response_settings = dict(
+            base_url=base_url, profanity_check=profanity_check, **model_kwargs
+        )
+        if prompt_layout not in PROMPT_LAYOUTS:
+            raise ValueError(f"Unknown prompt_layout: {prompt_layout}")
+        self.prompt_layout = prompt_layout
+        self._apply_prompt_layout()
+        self.prompt_budget = PromptBudget(prompt_token_budget)
+        self.schema_linker = schema_linker
+        # anything with GoldIndex.select(questions, k) replaces the retrieved gold records
+        self.gold_selector = gold_selector
+        self.gold_top_k = gold_top_k
+        self.gold_diversifier = gold_diversifier
+        self.static_validator = static_validator
+
+        self._db_lock = threading.Lock()
+
+    def predict_sql(self, context: ContextData, db: DbConnection | None = None) -> str:
+        self._select_gold([context])
+        return self._run(self.apredict_sql(context, db))
+
+    def _select_gold(self, contexts: list[ContextData]):
+        """Gold records of `gold_selector` in place of the retrieved ones, in one batch"""
+        if self.gold_selector is None or not contexts:
+            return
+        selected = self.gold_selector.select(
+            [context.question for context in contexts], self.gold_top_k
+        )
+        for context, gold_recs in zip(contexts, selected):
+            context.gold_recs = gold_recs
+
+    async def apredict_sql(
+        self, context: ContextData, db: DbConnection | None = None
+    ) -> str:
+        raise NotImplementedError
+
+    def predict_sql_batch(
+        self,
+        requests: list[tuple[ContextData, DbConnection | None]],
+        concurrency: int = 1,
+        on_done=None,
+        previous_calls: list[list[tuple[str, str]]] | None = None,
+    ) -> list["Prediction"]:
+        """Predict SQL for many questions with at most `concurrency` of them in flight.
+
+        The result keeps the order of `requests`; a failed question yields a Prediction
+        with `error` set instead of aborting the whole batch. `on_done(index, prediction)`
+        is called as soon as each question finishes, e.g. to checkpoint it.
+
+        `previous_calls` holds the (prompt hash, response) pairs a previous run recorded
+        for each question. A prompt rendered identically gets the recorded response
+        back, so only questions whose prompts changed reach the LLM.
+        """
+        self._select_gold([context for context, _ in requests])
+        return self._run(
+            self._apredict_sql_batch(requests, concurrency, on_done, previous_calls)
+        )
+
+    async def _apredict_sql_batch(
+        self,
+        requests: list[tuple[ContextData, DbConnection | None]],
+        concurrency: int,
+        on_done=None,
+        previous_calls: list[list[tuple[str, str]]] | None = None,
+    ) -> list["Prediction"]:
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        previous_calls = previous_calls or [[] for _ in requests]
+
+        async def predict(index: int, context: ContextData, db: DbConnection | None) -> Prediction:
+            async with semaphore:
+                lines = []
+                report_lines.set(lines)
+                trace = QuestionTrace()
+                for prompt_hash, content in previous_calls[index]:
+                    trace.previous.setdefault(prompt_hash, []).append(content)
+                question_trace.set(trace)
+                started = time.perf_counter()
+                try:
+                    prediction = Prediction(
+                        sql=await self.apredict_sql(context, db), report=lines
+                    )
+                except Exception as e:
+                    prediction = Prediction(sql="", report=lines, error=e)
+                prediction.calls = trace.calls
+                prediction.attempts = len(trace.calls)
+                prediction.reused_calls = trace.reused
+                prediction.connects = trace.connects
+                prediction.connect_seconds = trace.connect_seconds
+                prediction.prompt_tokens = trace.prompt_tokens
+                prediction.cached_prompt_tokens = trace.cached_prompt_tokens
+                prediction.seconds = time.perf_counter() - started
+                if on_done is not None:
+                    on_done(index, prediction)
+                return prediction
+
+        return await asyncio.gather(
+            *(predict(i, context, db) for i, (context, db) in enumerate(requests))
+        )
+
+    async def _ainvoke(
+        self, messages: list[BaseMessage], temperature: float | None = None
+    ) -> BaseMessage:
+        trace = question_trace.get()
+        if trace is not None:
+            prompt_hash = self._response_key(messages, temperature)
+            recorded = trace.previous.get(prompt_hash)
+            if recorded:
+                trace.reused += 1
+                trace.calls.append((prompt_hash, recorded[0]))
+                return AIMessage(content=recorded.pop(0))
+        key, result = self._cache_lookup(messages, temperature)
+        if result is None:
+            result = await self._acomplete(messages, temperature)
+            self._cache_store(key, result)
+        if trace is not None:
+            trace.calls.append((prompt_hash, result.content))
+        return result
+
+    async def _acomplete(
+        self, messages: list[BaseMessage], temperature: float | None = None
+    ) -> BaseMessage:
+        """Call the chat model, waiting out rate limits and retrying transient failures.
+
+        Transport retries are invisible to the SQL regeneration loop, `retries_num` only
+        counts answers the database rejected.
+        """
+        model = self.model if temperature is None else self.model.bind(temperature=temperature)
+        tokens = sum(len(str(message.content)) for message in messages) // 4
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire(tokens)
+            throttled = False
+            try:
+                if self.stream_sql:
+                    result = await self._astream_until_sql(model, messages)
+                else:
+                    result = await model.ainvoke(messages)
+                TOKEN_USAGE.add(result)
+                return result
+            except Exception as e:
+                status = response_status(e)
+                throttled = status == 429
+                transient = throttled or (status or 0) >= 500 or isinstance(e, httpx.TransportError)
+                if not transient or attempt >= self.transport_retries:
+                    raise
+                # full jitter keeps concurrent questions from retrying in lockstep
+                backoff = min(self.transport_backoff_max, self.transport_backoff * 2**attempt)
+                delay = retry_after(e) + random.uniform(0, backoff)
+                attempt += 1
+                logging.warning(
+                    f"Chat API call failed ({e!r}), retry {attempt}/{self.transport_retries} in {delay:.1f}s"
+                )
+            finally:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.release(throttled)
+            await asyncio.sleep(delay)
+
+    async def _astream_until_sql(self, model, messages: list[BaseMessage]) -> BaseMessage:
+        """Stream the completion and stop generating once the SQL block is closed."""
+        started = time.perf_counter()
+        message = None
+        stream = model.astream(messages)
+        try:
+            async for chunk in stream:
+                # adding chunks also merges the usage some providers send at the end
+                message = chunk if message is None else message + chunk
+                if sql_block_closed(message.content):
+                    logging.debug(
+                        f"SQL block closed after {time.perf_counter() - started:.2f}s "
+                        f"and {len(message.content)} characters, cancelling the rest of the stream"
+                    )
+                    break
+        finally:
+            # closing the generator drops the HTTP stream, the provider stops generating
+            await stream.aclose()
+        if message is None:
+            return AIMessage(content="")
+        return AIMessage(content=message.content, usage_metadata=message.usage_metadata)
+
+    async def _agenerate_first_valid(
+        self, messages: list[BaseMessage], is_valid
+    ) -> tuple[BaseMessage, bool]:
+        """Sample `speculative_candidates` completions at once, keep the first valid one.
+
+        Candidates get temperatures jittered upwards from the model temperature and are
+        checked by the `is_valid` coroutine as soon as they arrive; the requests still in
+        flight are cancelled when one passes. If none does, the completion sampled at the
+        lowest temperature is returned together with False.
+        """
+        base_temperature = self.model.temperature or 0.0
+
+        async def candidate(i: int) -> tuple[int, BaseMessage | None, bool]:
+            temperature = None
+            if i:
+                temperature = base_temperature + i * self.speculative_temperature_step
+            try:
+                result = await self._ainvoke(messages, temperature)
+            except Exception as e:
+                logging.debug(f"Speculative candidate {i} failed: {e}")
+                return i, None, False
+            return i, result, await is_valid(result)
+
+        tasks = [
+            asyncio.ensure_future(candidate(i)) for i in range(self.speculative_candidates)
+        ]
+        try:
+            results = {}
+            for next_done in asyncio.as_completed(tasks):
+                i, result, valid = await next_done
+                if valid:
+                    return result, True
+                if result is not None:
+                    results[i] = result
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if not results:
+            # every candidate failed in transport, surface the error of the base one
+            return await self._ainvoke(messages), False
+        return results[min(results)], False
+
+    async def _avalidates(
+        self, db: DbConnection, sql: str, context: ContextData | None = None
+    ) -> bool:
+        try:
+            await self._avalidate(db, sql, context)
+        except Exception:
+            return False
+        return True
+
+    async def _avalidate(self, db: DbConnection, sql: str, context: ContextData | None = None):
+        if context is not None:
+            self._static_check(context, sql)
+        return await self._aexecute(db, self._validation_sql(sql))
+
+    def _static_check(self, context: ContextData, sql: str):
+        """Raise what `static_validator` finds wrong with `sql`, before it reaches the database"""
+        if self.static_validator is None or not context.tables_info:
+            return
+        schema = SCHEMA_GRAPHS.get(context.tables_info).columns
+        issues = self.static_validator.validate(sql, schema)
+        if issues:
+            raise StaticValidationError(issues)
+
+    def _validation_sql(self, sql: str, mode: str | None = None) -> str:
+        """Query that raises the parser and binder errors of `sql` without scanning data.
+
+        "limit0" wraps the query so the result keeps its column metadata, "explain" only
+        plans it, and "execute" runs the query as is; only the latter also catches
+        errors raised while reading rows, such as failed casts.
+        """
+        mode = mode or self.validation_mode
+        if mode == "execute":
+            return sql
+        # newlines keep a trailing "--" comment from swallowing the wrapper
+        body = sql.strip().rstrip(";")
+        if mode == "explain":
+            return f"EXPLAIN {body}"
+        return f"SELECT * FROM (\n{body}\n) AS validated_query LIMIT 0"
+
+    def _invoke(self, messages: list[BaseMessage]) -> BaseMessage:
+        key, cached = self._cache_lookup(messages)
+        if cached is not None:
+            return cached
+        result = self._run(self._acomplete(messages))
+        self._cache_store(key, result)
+        return result
+
+    def _cache_lookup(
+        self, messages: list[BaseMessage], temperature: float | None = None
+    ) -> tuple[str | None, BaseMessage | None]:
+        if self.cache is None:
+            return None, None
+        key = self._response_key(messages, temperature)
+        content = self.cache.get(key)
+        return key, (AIMessage(content=content) if content is not None else None)
+
+    def _response_key(
+        self, messages: list[BaseMessage], temperature: float | None = None
+    ) -> str:
+        if temperature is None:
+            temperature = self.model.temperature
+        # completions cut at the SQL fence must not be served to full-length runs
+        settings = dict(self._response_settings, stream_sql=self.stream_sql)
+        return LLMResponseCache.key(self.model.model, temperature, messages, settings)
+
+    def _cache_store(self, key: str | None, result: BaseMessage):
+        if key is not None:
+            self.cache.put(key, result.content)
+
+    def _run(self, coro):
+        """Block until `coro` has run on the loop of the chat client, from any thread"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+        coro.close()
+        raise RuntimeError("The synchronous API blocks, await the async one inside a loop")
+
+    async def _aexecute(self, db: DbConnection, sql: str):
+        # DbConnection is not guaranteed to be thread-safe, so queries coming from
+        # concurrently evaluated questions are serialized.
+        def execute():
+            with self._db_lock:
+                return db.execute(sql)
+
+        return await asyncio.to_thread(execute)
+
+    @staticmethod
+    def _to_chunks(arr: list[any], size: int) -> list[list[any]]:
+        return [arr[i : i + size] for i in range(0, len(arr), size)]
+
+    async def _filter_hints(
+        self, context: ContextData, fragments: "PromptFragments | None" = None
+    ) -> list[str]:
+        fragments = fragments or PromptFragments(self, context)
+        if not self.hint_filter_system_prompt:
+            raise ValueError("Missing 'hint_filter_system_prompt' key in the prompt")
+        if not self.hint_filter_user_prompt:
+            raise ValueError("Missing 'hint_filter_user_prompt' key in the prompt")
+        if context.hints:
+            hints_str = "\n".join(context.hints)
+        else:
+            hints_str = ""
+        logging.debug(f"Question: {context.question}")
+        logging.debug(f"Original hints: \n{hints_str}")
+        chunk_size = 5
+        if context.hints:
+            hint_chunks = self._to_chunks(context.hints, chunk_size)
+        else:
+            hint_chunks = []
+        shared = {
+            "ddl": fragments.ddl,
+            "gold": fragments.gold,
+            "stats": fragments.stats,
+            "question": context.question,
+        }
+        semaphore = asyncio.Semaphore(max(1, self.hint_filter_concurrency))
+
+        async def filter_chunk(chunk: list[str]) -> list[str]:
+            messages = [
+                SystemMessage(
+                    content=self.hint_filter_system_prompt.format(
+                        hints="\n".join(chunk), **shared
+                    )
+                ),
+                HumanMessage(
+                    content=self.hint_filter_user_prompt.format(
+                        hints="\n".join(chunk), **shared
+                    )
+                ),
+            ]
+            async with semaphore:
+                response = (await self._ainvoke(messages)).content
+            return [] if "NONE" == response else response.split("\n")
+
+        # gather keeps the chunk order, so the merged hints keep the original order
+        filtered_chunks = await asyncio.gather(*(filter_chunk(c) for c in hint_chunks))
+        result = [hint for chunk in filtered_chunks for hint in chunk]
+        if hint_chunks:
+            hints_str = "\n".join(result)
+        logging.debug(f"Reduced hints: \n {hints_str}")
+        return result
+
+    def enhance_question(self, question: str):
+        if self.enhance_system_prompt:
+            messages = [
+                SystemMessage(content=self.enhance_system_prompt),
+                HumanMessage(content=question),
+            ]
+            return self._invoke(messages).content
+        else:
+            raise ValueError("Missing 'enhance_system_prompt' key in the prompt")
+
+    def name(self) -> str:
+        return self.model_name if self.model_name is not None else self.model.model
+
+    @staticmethod
+    def _parse_sql(response: BaseMessage) -> str:
+        return extract_sql(response.content).sql
+
+    def _apply_prompt_layout(self):
+        """Reorder the first-generation templates so all questions share a long prefix.
+
+        DeepSeek and GigaChat serve a prompt prefix they have seen before from their
+        context cache, cheaper and faster. The system templates end with bare section
+        placeholders: the sections rendered from the database stay at the end of the
+        system message, while the per-question hints and gold examples move to the head
+        of the user message, right before the question.
+        """
+        if self.prompt_layout == "template":
+            return
+        tail = _SECTION_TAIL.search(self.system_prompt)
+        if tail is None:
+            logging.warning("system_prompt does not end with section placeholders, layout kept")
+            return
+        sections = re.findall(r"\{(\w+)\}", tail.group())
+        shared = [f"{{{name}}}" for name in sections if name in SHARED_SECTIONS]
+        own = [f"{{{name}}}" for name in sections if name not in SHARED_SECTIONS]
+        self.system_prompt = self.system_prompt[: tail.start()] + "\n\n" + " ".join(shared)
+        self.user_prompt = "\n\n".join(own) + "\n\n" + self.user_prompt
+
+    def _init_prompt(self, prompt_data: dict[str, str]):
+        if "system_prompt" not in prompt_data:
+            raise ValueError("Missing 'system_prompt' key in the prompt")
+        if "user_prompt" not in prompt_data:
+            raise ValueError("Missing 'user_prompt' key in the prompt")
+        if "regen_system_prompt" not in prompt_data:
+            raise ValueError("Missing 'regen_system_prompt' key in the prompt")
+        if "regen_user_prompt" not in prompt_data:
+            raise ValueError("Missing 'regen_user_prompt' key in the prompt")
+
+        self.system_prompt = prompt_data["system_prompt"]
+        self.user_prompt = prompt_data["user_prompt"]
+        self.regen_system_prompt = prompt_data["regen_system_prompt"]
+        self.regen_user_prompt = prompt_data["regen_user_prompt"]
+
+        self.hint_filter_system_prompt = prompt_data.get(
+            "hint_filter_system_prompt", ""
+        )
+        self.hint_filter_user_prompt = prompt_data.get("hint_filter_user_prompt", "")
+        self.enhance_system_prompt = prompt_data.get("enhance_system_prompt", "")
+
+    @staticmethod
+    def _gold_to_str(gold: list[GoldRecord]) -> str:
+        text_gold_recs: list[str] = []
+        for g in gold:
+            text_gold_recs.append(f"Вопрос:{g.question}: ```sql\n{g.sql}\n```")
+        gold_str = "\n".join(text_gold_recs)
+        return f"""\nПримеры sql запросов: {gold_str}"""
+
+    @staticmethod
+    def _hints_to_str(hints: list[str]) -> str:
+        hints_str = "\n".join(hints)
+        return f"""Вот полезная информация которую нужно использовать в SELECT: \n{hints_str}"""
+
+    @staticmethod
+    def _ddl_to_str(ddl: str) -> str:
+        if ddl:
+            return f"""Схема базы: {ddl}"""
+        else:
+            return ""
+
+    def _tables_info_to_str(
+        self,
+        tables_info: list[TableInfo],
+        max_samples: int | None = None,
+        schema: list[TableInfo] | None = None,
+    ) -> str:
+        """Schema section of the prompt; `schema` holds all tables when `tables_info` was pruned"""
+        if not self.schema_type:
+            text_cols_info: list[str] = [
+                block
+                for block in (self._render_table(t, max_samples) for t in tables_info)
+                if block
+            ]
+            cols_str = "\n".join(text_cols_info)
+            return f"""\nДополнительная информация: {cols_str}"""
+        elif self.schema_type == "M-schema":
+            text_cols_info: list[str] = ["【Schema】"]
+            text_cols_info.extend(self._render_table(t, max_samples) for t in tables_info)
+            final_str = "\n".join(text_cols_info)
+            return final_str
+        else:
+            raise NotImplementedError
+
+    def _render_table(self, table_info: TableInfo, max_samples: int | None = None) -> str:
+        return SCHEMA_CACHE.get_or_render(
+            table_info,
+            self.schema_type,
+            lambda t: self._table_to_str(t, max_samples),
+            variant=max_samples,
+        )
+
+    def _table_to_str(self, table_info: TableInfo, max_samples: int | None = None) -> str:
+        table_name = table_info.name
+        if not self.schema_type:
+            return "\n".join(
+                f"Таблица: {table_name}, {col_info.pretty_print()}"
+                for col_info in table_info.cols_info
+            )
+        text_cols_info: list[str] = [f"# Table: {table_name}", "["]
+        for i, col_info in enumerate(table_info.cols_info):
+            examples = col_info.categories if col_info.categories else col_info.samples
+            if max_samples is not None and isinstance(examples, (list, tuple)):
+                examples = examples[:max_samples]
+            col_str = (
+                f"({col_info.name}:{col_info.data_type},{col_info.description},"
+                f"Examples: {examples})"
+            )
+            if i < len(table_info.cols_info) - 1:
+                col_str += ","
+            text_cols_info.append(col_str)
+        text_cols_info.append("]")
+        return "\n".join(text_cols_info)
+
+    def _build_messages(
+        self, context: ContextData, fragments: "PromptFragments"
+    ) -> list[BaseMessage]:
+        """First-generation messages, trimmed section by section to the token budget"""
+        trimmed = False
+        while True:
+            messages = [
+                SystemMessage(content=self._build_system_prompt(context, fragments)),
+                HumanMessage(content=self._build_user_prompt(context, fragments)),
+            ]
+            if self.prompt_budget.fits(messages, fragments):
+                break
+            if not fragments.trim():
+                logging.warning(
+                    f"Prompt stays over the budget of {self.prompt_budget.max_tokens} tokens: "
+                    f"{self.prompt_budget.breakdown(messages, fragments)}"
+                )
+                break
+            trimmed = True
+        if trimmed:
+            logging.info(
+                f"Prompt trimmed to {fragments.max_gold} gold records and "
+                f"{fragments.max_samples} sample values per column: "
+                f"{self.prompt_budget.breakdown(messages, fragments)}"
+            )
+        return messages
+
+    def _build_system_prompt(
+        self, context: ContextData, fragments: "PromptFragments | None" = None
+    ) -> str:
+        fragments = fragments or PromptFragments(self, context)
+        system_prompt = self.system_prompt.format(
+            hints=fragments.hints,
+            ddl=fragments.ddl,
+            gold=fragments.gold,
+            stats=fragments.stats,
+        )
+
+        return system_prompt
+
+    def _build_user_prompt(
+        self, context: ContextData, fragments: "PromptFragments | None" = None
+    ) -> str:
+        fragments = fragments or PromptFragments(self, context)
+        user_prompt = self.user_prompt.format(
+            hints=fragments.hints,
+            ddl=fragments.ddl,
+            gold=fragments.gold,
+            stats=fragments.stats,
+            question=context.question,
+        )
+
+        return user_prompt
+
+    def _build_regen_system_prompt(
+        self,
+        context: ContextData,
+        failed_sql: str,
+        sql_error: str,
+        fragments: "PromptFragments | None" = None,
+    ) -> str:
+        fragments = fragments or PromptFragments(self, context)
+        fragments.widen()
+        system_prompt = self.regen_system_prompt.format(
+            sql=failed_sql,
+            result=sql_error,
+            gold=fragments.gold,
+            hints=fragments.hints,
+            ddl=fragments.ddl,
+            stats=fragments.stats,
+        )
+
+        return system_prompt
+
+    def _build_regen_user_prompt(
+        self,
+        context: ContextData,
+        failed_sql: str,
+        sql_error: str,
+        fragments: "PromptFragments | None" = None,
+    ) -> str:
+        fragments = fragments or PromptFragments(self, context)
+        system_prompt = self.regen_user_prompt.format(
+            question=context.question,
+            sql=failed_sql,
+            result=sql_error,
+            gold=fragments.gold,
+            hints=fragments.hints,
+            ddl=fragments.ddl,
+            stats=fragments.stats,
+        )
+
+        return system_prompt